@@ -56,6 +56,15 @@ class TagSyncActionBase(InterfaceActionBase):
         if ac is not None:
             return ConfigWidget(ac)
 
+    def cli_main(self, args):
+        '''
+        Run Tag Sync headless with: calibre-debug -r "Tag Sync" -- /path/to/library [--incremental]
+        The first argument is the name of the plugin.
+        '''
+        #* Like the config widget, imported here to keep the plugin light to load
+        from calibre_plugins.tag_sync.cli import main # type: ignore
+        return main(args[1:])
+
     def save_settings(self, config_widget):
         '''
         Save the settings specified by the user with config_widget.
@@ -1,6 +1,10 @@
-from . import config, helper, tag_util
+from . import helper, instrumentation, settings, sync, tag_util
+from calibre.db.listeners import EventType
+from calibre.gui2 import Dispatcher
 from calibre.gui2.actions import InterfaceAction
-from qt.core import QToolButton, QMenu
+from calibre.gui2.threaded_jobs import ThreadedJob
+from qt.core import QToolButton, QMenu, QInputDialog, QLineEdit
+from typing import Collection, Optional
 import logging
 
 logging.basicConfig(level=logging.INFO)
@@ -26,6 +30,13 @@ class TagSyncPlugin(InterfaceAction):
         #* Create Dialog helper
         helper.Dialog.create(self.gui)
 
+        #* Lets the sync job refresh books from its own thread
+        self.refresh_books_dispatcher = Dispatcher(self.refresh_books)
+
+        #* The compiled rules are kept between syncs
+        self.rule_cache = tag_util.RuleCache()
+        self.listened_db = None
+
         self.menu = QMenu(self.gui)
         self.qaction.setMenu(self.menu)
 
@@ -35,16 +46,35 @@ class TagSyncPlugin(InterfaceAction):
         self.qaction.triggered.connect(self.sync_for_selected_books)
         self.create_menu_action(self.menu, "Tag Sync selected", "Tag Sync selected", icon=None, shortcut=None, description='Run Tag Sync for selected books', triggered=self.sync_for_selected_books, shortcut_name=None, persist_shortcut=False)
         self.create_menu_action(self.menu, "Tag Sync All", "Tag Sync All", icon=None, shortcut=None, description='Run Tag Sync for all books', triggered=self.sync_for_all_books, shortcut_name=None, persist_shortcut=False)
+        self.create_menu_action(self.menu, "Tag Sync search", "Tag Sync search...", icon=None, shortcut=None, description='Run Tag Sync for the books matching a search', triggered=self.sync_for_search, shortcut_name=None, persist_shortcut=False)
+        self.create_menu_action(self.menu, "Tag Sync incremental", "Tag Sync incremental", icon=None, shortcut=None, description='Run Tag Sync for books that changed since the last sync', triggered=self.sync_incremental, shortcut_name=None, persist_shortcut=False)
         self.create_menu_action(self.menu, "Tag Sync settings", "Tag Sync settings", icon=None, shortcut=None, description=None, triggered=lambda: self.interface_action_base_plugin.do_user_config(self.gui), shortcut_name=None, persist_shortcut=False)
 
     def initialization_complete(self):
-        config.set_prefs(self.gui.library_path)
+        settings.set_prefs(self.gui.library_path)
+        self.listen_to_db(helper.get_db(self.gui))
 
     def library_changed(self, db):
-        config.set_prefs(self.gui.library_path)
+        settings.set_prefs(self.gui.library_path)
+        self.rule_cache.invalidate()
+        self.listen_to_db(db.new_api)
 
     def apply_settings(self):
-        pass
+        #* The saved settings can change any rule
+        self.rule_cache.invalidate()
+
+    def listen_to_db(self, db):
+        if self.listened_db is not None:
+            self.listened_db.remove_listener(self.db_event)
+
+        db.add_listener(self.db_event)
+        self.listened_db = db
+
+    def db_event(self, db, event_type, event_data):
+        #* Runs in calibre's listener thread, only mark the rules for a check
+        if event_type in (EventType.metadata_changed, EventType.items_renamed, EventType.items_removed):
+            if event_data[0] in settings.prefs['columns']:
+                self.rule_cache.mark_changed()
 
     def sync_for_selected_books(self):
         #* Get the selected books from the library view
@@ -60,29 +90,116 @@ class TagSyncPlugin(InterfaceAction):
         selected_books = db.all_book_ids()
 
         if helper.Dialog.get().question('Sync Tags for all books', f'You are about to change metadata for {len(selected_books)} books: continue?'):
-            self.tag_sync(selected_books)
+            self.tag_sync(selected_books, all_books=True)
+
+    def sync_for_search(self):
+        #* Ask for a calibre search expression, e.g. tags:"=scifi" or #genre:true
+        expression, ok = QInputDialog.getText(self.gui, 'Tag Sync search', 'Sync the books matching this search:',
+                                              QLineEdit.Normal, settings.prefs['last_search'])
+        expression = expression.strip()
+        if not ok or not expression:
+            return
 
-    def tag_sync(self, selected_books: list):
-        db = helper.get_db(self.gui)
+        settings.prefs['last_search'] = expression
+
+        try:
+            book_ids = helper.get_db(self.gui).search(expression)
+        except Exception as e:
+            helper.Dialog.get().error('Invalid search', f'The search \'{expression}\' could not be run.', str(e))
+            return
 
+        if not book_ids:
+            helper.Dialog.get().warning('No Books Found', f'No books match the search \'{expression}\'.')
+            return
+
+        self.start_tag_sync_job(f'Tag Sync for {len(book_ids)} books matching {expression}', sorted(book_ids), all_books=False)
+
+    def sync_incremental(self):
+        self.start_tag_sync_job('Tag Sync incremental', None, all_books=True)
+
+    def tag_sync(self, selected_books: Collection[int], all_books: bool = False):
         #* If no books are selected, show a warning
         if not selected_books:
             helper.Dialog.get().warning('No Books Selected', 'Please select books to apply the tag.')
             return
 
-        tag_rules = tag_util.TagRules.build_tag_rules(self.gui)
+        #* The ids are only iterated chunk by chunk, no copy is needed
+        self.start_tag_sync_job(f'Tag Sync for {len(selected_books)} books', selected_books, all_books)
+
+    def start_tag_sync_job(self, description: str, book_ids: Optional[Collection[int]], all_books: bool):
+        stats = instrumentation.SyncStats(enabled=settings.prefs['collect_stats'])
+
+        #* Run the sync as background job, the GUI stays responsive
+        job = ThreadedJob('tag_sync', description, self.tag_sync_job, (helper.get_db(self.gui), self.gui.library_path, book_ids, all_books, stats), {},
+                          Dispatcher(self.tag_sync_done), max_concurrent_count=1, killable=True)
+        self.gui.job_manager.run_threaded_job(job)
+        self.gui.status_bar.show_message('Tag Sync started', 3000)
+
+    def tag_sync_job(self, db, library_path: str, book_ids: Optional[Collection[int]], all_books: bool, stats: instrumentation.SyncStats,
+                     log=None, abort=None, notifications=None):
+        '''
+        Runs in the job thread, returns the tag rules, the change set and the statistics
+        '''
+        #* A library switch during the job must not close the rules it reads
+        with settings.rules.use():
+            tag_rules, change_set = sync.run_sync(db, library_path, book_ids, all_books, abort=abort, notifications=notifications, stats=stats,
+                                                  rule_cache=self.rule_cache)
+
+        #* A killed job doesn't get its callback, refresh the written books from here
+        if change_set.cancelled:
+            self.refresh_books_dispatcher(change_set.changed_book_ids(), change_set.changed_columns())
+
+        return tag_rules, change_set, stats
+
+    def tag_sync_done(self, job):
+        if job.failed:
+            self.gui.job_exception(job, dialog_title='Tag Sync failed')
+            return
+
+        tag_rules, change_set, stats = job.result
 
-        for book_id in selected_books:
-            book = db.get_metadata(book_id)
-            book = tag_rules.apply_to_book(book)
-            db.set_metadata(book_id, book)
+        if change_set.cancelled:
+            return
 
         #* Refresh the GUI after metadata changes
-        selected_books = self.gui.library_view.get_selected_ids()
-        self.gui.refresh_all()
-        self.gui.library_view.select_rows(selected_books)
+        with stats.phase('refresh'):
+            self.refresh_books(change_set.changed_book_ids(), change_set.changed_columns())
+
+        stats.log(logger)
+
+        msg = f'Tag Sync completed successfully.\n{len(change_set.changed_book_ids())} books changed, {change_set.untouched_count()} books untouched.'
+        details: list[str] = list()
+
+        if stats.enabled:
+            details.append(stats.report())
+
+        #* Report add tags cycles, all tags of a cycle get added together
+        if tag_rules.cycles:
+            msg += f'\nThe add tags rules contain {len(tag_rules.cycles)} cycle(s).'
+            details.append('Add tags cycles:\n' + '\n'.join('  ' + ' -> '.join(cycle) for cycle in tag_rules.cycles))
+
+        helper.Dialog.get().info('Tag Sync', msg, '\n\n'.join(details) or None)
+
+    def refresh_books(self, book_ids: set[int], columns: set[str]):
+        #* Only refresh the rows of the changed books, the model isn't reset so the selection stays
+        if not book_ids:
+            return
 
-        helper.Dialog.get().info('Tag Sync', 'Tag Sync completed successfully.')
+        view = self.gui.library_view
+        scroll_position = view.verticalScrollBar().value()
+
+        #* The book details only need a redraw if the current book changed
+        current_index = view.currentIndex()
+        current_row = current_index.row() if current_index.isValid() and view.model().id(current_index) in book_ids else -1
+
+        view.model().refresh_ids(list(book_ids), current_row=current_row)
+        view.verticalScrollBar().setValue(scroll_position)
+
+        #* The tag browser only needs new counts if it shows one of the changed columns
+        #* The browser model holds the hidden categories of the current library
+        hidden_categories = self.gui.tags_view.model().hidden_categories
+        if any(column not in hidden_categories for column in columns):
+            self.gui.tags_view.recount()
 
     def get_all_elements_from_custom_column(self, custom_column_name: str) -> set:
         #* Check if the custom column exists and is of type 'text'
@@ -100,20 +217,10 @@ class TagSyncPlugin(InterfaceAction):
         #* Get the current database
         db = self.gui.current_db.new_api
 
-        #* Get all book IDs
-        book_ids = db.all_book_ids() #* This will return a list of all book IDs
-
-        #* Now, retrieve the values for your custom column for all books
-        custom_column_values = set()
-
-        for book_id in book_ids:
-            #* Fetch metadata for each book (including the custom column)
-            metadata = db.get_metadata(book_id)
-
-            #* Extract the value of the custom column
-            custom_column_value = metadata.get(custom_column_name)
-
-            if custom_column_value:
-                custom_column_values.update(custom_column_value)
+        #* Read the values from the item table of the column instead of the metadata of every book,
+        #* both calls copy under the db lock, a sync job may write meanwhile
+        id_map = db.get_id_map(custom_column_name)
 
-        return custom_column_values
+        #* Only the values that are used by at least one book
+        return {id_map[item_id] for item_id, usage_count in db.get_usage_count_by_id(custom_column_name).items()
+                if usage_count > 0 and item_id in id_map}
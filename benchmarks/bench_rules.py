@@ -0,0 +1,93 @@
+'''
+Benchmark the rule engine on synthetic libraries of growing size, without a running calibre GUI.
+Run from the plugin directory with:
+
+    calibre-debug -e benchmarks/bench_rules.py -- --books 1000,10000,100000
+
+Every phase reports its wall time and the peak memory it allocated.
+'''
+from fake_library import generate_library
+import argparse
+import importlib
+import os
+import sys
+import time
+import tracemalloc
+
+#* Import the plugin as package, its modules use relative imports
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(PLUGIN_DIR))
+PACKAGE = os.path.basename(PLUGIN_DIR)
+
+rule_store = importlib.import_module(f'{PACKAGE}.rule_store')
+settings = importlib.import_module(f'{PACKAGE}.settings')
+sync = importlib.import_module(f'{PACKAGE}.sync')
+tag_util = importlib.import_module(f'{PACKAGE}.tag_util')
+
+
+def measure(name: str, func, trace_memory: bool):
+    if trace_memory:
+        tracemalloc.start()
+
+    start_time = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start_time
+
+    #* Retained is what the result still holds after the phase
+    retained, peak = 0, 0
+    if trace_memory:
+        retained, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    print(f'  {name:<22} {elapsed * 1000:>10.1f} ms {peak / 2 ** 20:>10.2f} MiB {retained / 2 ** 20:>10.2f} MiB')
+    return result
+
+
+def apply_to_all_books(db, tag_rules: tag_util.TagRules):
+    #* The per book path, without writing back
+    for book_id in db.all_book_ids():
+        tag_rules.apply_to_book(db.get_metadata(book_id))
+
+
+def run(books: int, opts: argparse.Namespace):
+    db, prefs = generate_library(books=books, tags=opts.tags or books // 3, alias_density=opts.alias_density,
+                                 chain_depth=opts.chain_depth, columns=opts.columns, tags_per_book=opts.tags_per_book)
+
+    #* Plain dicts are enough for the prefs, the rules go to an in-memory store
+    settings.prefs = prefs
+    settings.rules = rule_store.RuleStore(':memory:')
+    settings.rules.migrate(prefs)
+
+    print(f'{books} books, {sum(len(field.table.id_map) for field in db.fields.values())} items, {len(settings.rules)} configured tags')
+    print(f'  {"phase":<22} {"time":>13} {"peak":>14} {"retained":>14}')
+
+    trace_memory = not opts.no_memory
+    measure('Tag.build_tags', lambda: tag_util.Tag.build_tags(db), trace_memory)
+    tag_rules = measure('build_tag_rules', lambda: tag_util.TagRules.build_tag_rules(db), trace_memory)
+    measure('compile_add_tags', tag_rules.compile_add_tags, trace_memory)
+    measure('apply_to_book', lambda: apply_to_all_books(db, tag_rules), trace_memory)
+    change_set = measure('sync_books', lambda: sync.sync_books(db, tag_rules, db.all_book_ids(), opts.chunk_size), trace_memory)
+    measure('sync_books unchanged', lambda: sync.sync_books(db, tag_rules, db.all_book_ids(), opts.chunk_size), trace_memory)
+
+    print(f'  {len(change_set.changed_book_ids())} books changed by the first sync')
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the Tag Sync rule engine on synthetic libraries.')
+    parser.add_argument('--books', default='1000,10000,50000', help='Comma separated library sizes')
+    parser.add_argument('--tags', type=int, default=0, help='Number of tags, defaults to a third of the books')
+    parser.add_argument('--alias-density', type=float, default=0.1, help='Share of tags with an alias')
+    parser.add_argument('--chain-depth', type=int, default=3, help='Length of the add tags chains')
+    parser.add_argument('--columns', type=int, default=2, help='Number of synced columns')
+    parser.add_argument('--tags-per-book', type=int, default=5)
+    parser.add_argument('--chunk-size', type=int, default=sync.CHUNK_SIZE, help='Number of books synced together')
+    parser.add_argument('--no-memory', action='store_true', help='Skip the memory tracing, it slows down the phases')
+    opts = parser.parse_args([arg for arg in sys.argv[1:] if arg != '--'])
+
+    for books in [int(value) for value in opts.books.split(',')]:
+        run(books, opts)
+
+
+if __name__ == '__main__':
+    main()
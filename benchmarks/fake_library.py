@@ -0,0 +1,190 @@
+'''
+In-memory stand-in for the parts of calibre's `Cache` API the plugin uses,
+plus a generator for synthetic libraries
+'''
+import contextlib
+import random
+
+class FakeTable:
+    def __init__(self):
+        self.id_map      : dict[int, str]      = dict()
+        self.col_book_map: dict[int, set[int]] = dict()
+
+
+class FakeField:
+    def __init__(self):
+        self.table = FakeTable()
+
+    def __iter__(self):
+        return iter(self.table.id_map)
+
+
+class FakeFieldMetadata:
+    def __init__(self, custom_columns: dict):
+        self.custom_columns = custom_columns
+
+    def custom_field_metadata(self, include_composites=True) -> dict:
+        return self.custom_columns
+
+
+class FakeBook:
+    '''
+    Only the `get` and `set` part of `Metadata`
+    '''
+    def __init__(self, values: dict):
+        self.values = values
+
+    def get(self, key, default=None):
+        return self.values.get(key, default)
+
+    def set(self, key, value):
+        self.values[key] = value
+
+
+class FakeCache:
+    def __init__(self, columns: list[str]):
+        self.columns = columns
+        self.fields: dict[str, FakeField] = {column_name: FakeField() for column_name in columns}
+        self.field_metadata = FakeFieldMetadata({column_name: {'datatype': 'text'} for column_name in columns if column_name != 'tags'})
+
+        self.book_values: dict[int, dict[str, tuple[str, ...]]] = dict()
+
+        #* Items are case-insensitive like in calibre
+        self.item_ids: dict[str, dict[str, int]] = {column_name: dict() for column_name in columns}
+
+    def add_item(self, field: str, name: str) -> int:
+        item_ids = self.item_ids[field]
+        item_id = item_ids.get(name.lower())
+
+        if item_id is None:
+            table = self.fields[field].table
+            item_id = len(table.id_map) + 1
+            table.id_map[item_id] = name
+            table.col_book_map[item_id] = set()
+            item_ids[name.lower()] = item_id
+
+        return item_id
+
+    def add_book(self, book_id: int, values: dict[str, tuple[str, ...]]):
+        self.book_values[book_id] = {column_name: () for column_name in self.columns}
+        for column_name, names in values.items():
+            self.set_field(column_name, {book_id: names})
+
+    def all_book_ids(self) -> frozenset[int]:
+        return frozenset(self.book_values)
+
+    def books_for_field(self, field: str, item_id: int) -> set[int]:
+        return set(self.fields[field].table.col_book_map.get(item_id, ()))
+
+    @property
+    def safe_read_lock(self):
+        #* Single threaded, nothing to lock
+        return contextlib.nullcontext()
+
+    def get_id_map(self, field: str) -> dict[int, str]:
+        return dict(self.fields[field].table.id_map)
+
+    def get_usage_count_by_id(self, field: str) -> dict[int, int]:
+        return {item_id: len(book_ids) for item_id, book_ids in self.fields[field].table.col_book_map.items()}
+
+    def all_field_for(self, field: str, book_ids, default_value=None) -> dict:
+        return {book_id: self.book_values[book_id].get(field) or default_value for book_id in book_ids}
+
+    def set_field(self, field: str, book_id_to_val_map: dict, allow_case_change=True) -> set[int]:
+        table = self.fields[field].table
+
+        for book_id, names in book_id_to_val_map.items():
+            #* Unlink the old items
+            for name in self.book_values[book_id][field]:
+                table.col_book_map[self.item_ids[field][name.lower()]].discard(book_id)
+
+            names = tuple(dict.fromkeys(name for name in names if name))
+            for name in names:
+                table.col_book_map[self.add_item(field, name)].add(book_id)
+
+            self.book_values[book_id][field] = names
+
+        return set(book_id_to_val_map)
+
+    def rename_items(self, field: str, item_id_to_new_name_map: dict, change_index=True, restrict_to_book_ids=None) -> tuple[set[int], dict]:
+        #* Renaming to the name of another item merges the two, like in calibre
+        table = self.fields[field].table
+        affected_book_ids: set[int] = set()
+        id_map: dict[int, int] = dict()
+
+        for item_id, new_name in item_id_to_new_name_map.items():
+            old_name = table.id_map[item_id]
+            book_ids = {book_id for book_id in table.col_book_map[item_id]
+                        if restrict_to_book_ids is None or book_id in restrict_to_book_ids}
+
+            for book_id in book_ids:
+                names = self.book_values[book_id][field]
+                self.set_field(field, {book_id: tuple(new_name if name.lower() == old_name.lower() else name for name in names)})
+
+            #* The whole item goes away if no book uses it anymore
+            if restrict_to_book_ids is None and not table.col_book_map[item_id]:
+                del table.id_map[item_id]
+                del table.col_book_map[item_id]
+                del self.item_ids[field][old_name.lower()]
+
+            affected_book_ids.update(book_ids)
+            id_map[item_id] = self.item_ids[field][new_name.lower()]
+
+        return affected_book_ids, id_map
+
+    def get_metadata(self, book_id: int) -> FakeBook:
+        return FakeBook({column_name: list(values) for column_name, values in self.book_values[book_id].items()})
+
+    def set_metadata(self, book_id: int, book: FakeBook):
+        for column_name in self.columns:
+            self.set_field(column_name, {book_id: book.get(column_name, ())})
+
+
+def generate_library(books: int = 1000, tags: int = 500, alias_density: float = 0.1, chain_depth: int = 3,
+                     columns: int = 2, tags_per_book: int = 5, seed: int = 0) -> tuple[FakeCache, dict]:
+    '''
+    Build a synthetic library and the matching plugin prefs.
+    `alias_density` is the share of tags with an alias, the aliases are used by books as well.
+    Tags are linked in add tags chains of `chain_depth` steps.
+    '''
+    rand = random.Random(seed)
+
+    column_names = ['tags'] + [f'#column{index}' for index in range(1, columns)]
+    db = FakeCache(column_names)
+
+    prefs: dict = {
+        'columns': {column_name: {'include': True, 'prio': index} for index, column_name in enumerate(column_names)},
+        'tags': dict(),
+    }
+
+    #* Spread the tags over the columns, aliases are items of the same column
+    pool: list[tuple[str, str]] = list()
+    for index in range(tags):
+        column_name = column_names[index % columns]
+        display_name = f'Tag {index:06d}'
+        item_id = db.add_item(column_name, display_name)
+        pool.append((column_name, display_name))
+
+        tag_settings: dict = {'name': display_name.lower()}
+
+        if rand.random() < alias_density:
+            alias = f'Alias {index:06d}'
+            db.add_item(column_name, alias)
+            pool.append((column_name, alias))
+            tag_settings['name_aliases'] = [alias.lower()]
+
+        #* Every tag adds the next one, except at the end of a chain
+        if chain_depth > 0 and index % (chain_depth + 1) != chain_depth and index + 1 < tags:
+            tag_settings['add_tags'] = [f'Tag {index + 1:06d}']
+
+        if len(tag_settings) > 1:
+            prefs['tags'][f'{column_name}:{item_id}'] = tag_settings
+
+    for book_id in range(1, books + 1):
+        values: dict[str, list[str]] = dict()
+        for column_name, display_name in rand.sample(pool, min(tags_per_book, len(pool))):
+            values.setdefault(column_name, list()).append(display_name)
+
+        db.add_book(book_id, values)
+
+    return db, prefs
@@ -0,0 +1,60 @@
+from . import instrumentation, settings, sync
+import argparse
+import time
+
+def main(args: list[str]) -> int:
+    '''
+    Run Tag Sync without the GUI, e.g. from cron:
+    calibre-debug -r "Tag Sync" -- /path/to/library [--incremental | --search EXPRESSION] [--export-rules PATH] [--chunk-size BOOKS]
+    '''
+    parser = argparse.ArgumentParser(prog='calibre-debug -r "Tag Sync" --', description='Run Tag Sync for a calibre library without the GUI.')
+    parser.add_argument('library_path', help='Path of the calibre library')
+    scope = parser.add_mutually_exclusive_group()
+    scope.add_argument('--incremental', action='store_true', help='Only sync books that changed since the last sync')
+    scope.add_argument('--search', metavar='EXPRESSION', help='Only sync the books matching a calibre search, e.g. tags:"=scifi"')
+    parser.add_argument('--export-rules', metavar='PATH', help='Write the tag rules to a JSON file instead of syncing')
+    parser.add_argument('--chunk-size', type=int, metavar='BOOKS', help='Number of books read and written together, overrides the settings')
+    opts = parser.parse_args(args)
+
+    if opts.export_rules:
+        settings.set_prefs(opts.library_path)
+        settings.rules.export_json(opts.export_rules)
+        print(f'Exported {len(settings.rules)} tag rules to {opts.export_rules}')
+        return 0
+
+    #* Importing here keeps the plugin loadable without the database code
+    from calibre.library import db as open_library
+
+    start_time = time.perf_counter()
+    library = open_library(opts.library_path)
+    db = library.new_api
+    settings.set_prefs(opts.library_path)
+    open_time = time.perf_counter()
+
+    try:
+        if opts.search:
+            book_ids = sorted(db.search(opts.search))
+        else:
+            book_ids = None if opts.incremental else db.all_book_ids()
+        stats = instrumentation.SyncStats()
+        tag_rules, change_set = sync.run_sync(db, opts.library_path, book_ids, all_books=not opts.search, stats=stats,
+                                              chunk_size=opts.chunk_size)
+    finally:
+        library.close()
+    sync_time = time.perf_counter()
+
+    changed_count = len(change_set.changed_book_ids())
+    print(f'Tag Sync {"search" if opts.search else "incremental" if opts.incremental else "all"}: {opts.library_path}')
+    print(f'  Library opened in  {open_time - start_time:.3f}s')
+    print(f'  Synced in          {sync_time - open_time:.3f}s')
+    print(f'  Books processed    {change_set.book_count}')
+    print(f'  Books changed      {changed_count}')
+    print(f'  Books untouched    {change_set.book_count - changed_count}')
+    print(f'  Column changes     {change_set.column_change_count()}')
+
+    for cycle in tag_rules.cycles:
+        print(f'  Add tags cycle     {" -> ".join(cycle)}')
+
+    print(stats.report())
+
+    return 0
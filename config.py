@@ -1,8 +1,9 @@
-from . import helper, tag_util
+from . import helper, settings, tag_util
 from calibre.gui2.ui import Main as GUI
-from calibre.utils.config import JSONConfig
 from PyQt5.QtWidgets import QApplication
+from typing import Optional
 import bisect
+import logging
 import re
 import json
 
@@ -10,60 +11,51 @@ try:
     from qt.core import (Qt, QWidget, QGridLayout, QLabel, QPushButton, QUrl,
                           QGroupBox, QComboBox, QVBoxLayout, QCheckBox,
                           QLineEdit, QTabWidget, QAbstractItemView,
-                          QTableWidget, QHBoxLayout, QSize, QToolButton, QListWidget, QStackedWidget, QSpinBox, QFrame, QScrollArea)
+                          QTableWidget, QHBoxLayout, QSize, QToolButton, QListView, QSpinBox, QFrame, QScrollArea,
+                          QAbstractListModel, QAbstractProxyModel, QModelIndex, QTimer, QThread, pyqtSignal, QFileDialog)
 except ImportError:
     from PyQt5.Qt import (Qt, QWidget, QGridLayout, QLabel, QPushButton, QUrl,
                           QGroupBox, QComboBox, QVBoxLayout, QCheckBox,
                           QLineEdit, QTabWidget,QAbstractItemView,
-                          QTableWidget, QHBoxLayout, QSize, QToolButton, QListWidget, QStackedWidget, QSpinBox, QFrame, QScrollArea)
+                          QTableWidget, QHBoxLayout, QSize, QToolButton, QListView, QSpinBox, QFrame, QScrollArea,
+                          QAbstractListModel, QAbstractProxyModel, QModelIndex, QTimer, QThread, pyqtSignal, QFileDialog)
 
-#* This is where all preferences for this plugin will be stored
-#* prefs for this addon are library dependent and get reloaded if the library is switched
-#* The File gets stored alongside your main DB file at your library path
-prefs: JSONConfig = None
+logger = logging.getLogger(__name__)
 
-def set_prefs(library_path):
-    global prefs
-    prefs = JSONConfig('tag_sync', library_path)
-    prefs.defaults['columns'] = {'tags': {'include': True, 'prio': 0, 'split_tag_auto': True}}
+#* Number of book titles shown in the rule impact preview
+PREVIEW_SAMPLE_SIZE = 5
 
+#* Keeps loaders alive until they finish, even if the settings dialog was closed before
+running_loaders: set = set()
 
 class ConfigWidget(QWidget):
     def __init__(self, plugin_action):
         QWidget.__init__(self)
 
         self.plugin_action = plugin_action
-        self.tags = tag_util.Tag.build_tags(self.plugin_action.gui)
 
         #* Create the main layout elements
         self.main_layout = QVBoxLayout()
         self.tabs = QTabWidget()
-        self.tag_details = SearchableTagEditor(self.tags, self)
+        self.tag_details = SearchableTagEditor(self)
         self.column_widget = ColumnSelect(self)
-
-
-        #* Populate list and stack
-        self.populate_tags(self.tags)
+        self.options_widget = OptionsWidget(self)
 
         #* Populate column choices
         self.column_widget.populate(self.plugin_action.gui)
 
+        #* The tags load in the background, the dialog opens right away
+        self.tag_details.load(helper.get_db(self.plugin_action.gui))
+
         #* Link the layouts elements
         self.tabs.addTab(self.column_widget, "Column choice")
         self.tabs.addTab(self.tag_details, "Tag Details")
+        self.tabs.addTab(self.options_widget, "Options")
 
         self.main_layout.addWidget(self.tabs)
 
         self.setLayout(self.main_layout)
 
-    def populate_tags(self, tags):
-        for tag in tags:
-            index = bisect.bisect_left(self.tag_details.label_list, tag.name)
-
-            self.tag_details.label_list.insert(index, tag.name)
-            self.tag_details.list_widget.insertItem(index, tag.display_name)
-            self.tag_details.stack_widget.insertWidget(index, QWidget())
-
     def save_settings(self):
         #* Sace the settings for selected columns
         self.column_widget.save()
@@ -71,195 +63,403 @@ class ConfigWidget(QWidget):
         #* Save the settings for the tag details
         self.tag_details.save()
 
+        #* Save the general options
+        self.options_widget.save()
+
     def validate(self):
         return True
 
-class SearchableElementEditor(QWidget):
+class TagLoader(QThread):
+    '''
+    Builds the tag catalogue column by column, then counts the usage of all tags
+    and indexes which books use them
+    '''
+    column_loaded     = pyqtSignal(str, object)
+    counts_loaded     = pyqtSignal(object)
+    book_index_loaded = pyqtSignal(object)
+    loading_done      = pyqtSignal(bool)
+
+    def __init__(self, db):
+        super().__init__()
+
+        self.db = db
+        self.complete = False
+
+    def run(self):
+        try:
+            results: dict[str, tag_util.Tag] = dict()
+
+            #* The loader can outlive the dialog, the rules must stay open until it is done
+            with settings.rules.use():
+                for column, column_tags in tag_util.Tag.build_tags_by_column(self.db, results, with_counts=False):
+                    if self.isInterruptionRequested():
+                        return
+                    self.column_loaded.emit(column, column_tags)
+
+            self.complete = True
+
+            if not self.isInterruptionRequested():
+                self.counts_loaded.emit(tag_util.Tag.usage_counts_by_name(self.db))
+
+            #* Only needed for the rule impact preview
+            if not self.isInterruptionRequested():
+                self.book_index_loaded.emit(tag_util.Tag.books_by_name(self.db))
+        except Exception:
+            logger.exception('Loading the tags failed')
+        finally:
+            #* A signal to a bound slot is dropped if the editor was deleted meanwhile, unlike `finished` to a lambda
+            self.loading_done.emit(self.complete)
+
+class TagListModel(QAbstractListModel):
+    '''
+    Read only list of tags sorted by name, the view only asks for the visible rows
+    '''
     def __init__(self, parent=None):
         super().__init__(parent)
 
-        #* create list of element labels
-        self.label_list: list[str] = list()
+        self.tags        : list[tag_util.Tag] = list()
+        self.rows_by_name: dict[str, int]     = dict()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.tags)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+
+        tag = self.tags[index.row()]
+
+        if role == Qt.DisplayRole:
+            return tag.display_name
+        if role == Qt.ToolTipRole:
+            return f'From column: \'{tag.collection_name}\''
+
+        return None
+
+    def tag(self, row: int) -> tag_util.Tag:
+        return self.tags[row]
+
+    def key(self, row: int) -> str:
+        return self.tags[row].name
+
+    def row_of(self, key: str) -> int:
+        return self.rows_by_name.get(key, -1)
+
+    def labels(self) -> list[str]:
+        return [tag.display_name for tag in self.tags]
+
+    def add_tags(self, tags: list[tag_util.Tag]):
+        '''
+        Merge the tags of a column, a tag replaces the tag with the same name
+        '''
+        self.beginResetModel()
+
+        tags_by_name = {tag.name: tag for tag in self.tags}
+        tags_by_name.update((tag.name, tag) for tag in tags)
+
+        self.tags = sorted(tags_by_name.values(), key=lambda tag: tag.name)
+        self.rows_by_name = {tag.name: row for row, tag in enumerate(self.tags)}
+
+        self.endResetModel()
+
+    def set_usage_counts(self, counts: dict[str, int]):
+        for tag in self.tags:
+            tag.in_book_count = counts.get(tag.name, 0)
+
+class RowFilterProxyModel(QAbstractProxyModel):
+    '''
+    Shows a precomputed, sorted list of source rows.
+    Unlike QSortFilterProxyModel it doesn't call back into python for every source row when the filter changes.
+    '''
+    def __init__(self, parent=None):
+        super().__init__(parent)
+
+        #* None shows all source rows
+        self.rows: Optional[list[int]] = None
+
+    def setSourceModel(self, source_model):
+        self.beginResetModel()
+        super().setSourceModel(source_model)
+        self.rows = None
+        source_model.modelAboutToBeReset.connect(self.beginResetModel)
+        source_model.modelReset.connect(self.source_reset)
+        self.endResetModel()
+
+    def source_reset(self):
+        self.rows = None
+        self.endResetModel()
+
+    def set_rows(self, rows: Optional[list[int]]):
+        self.beginResetModel()
+        self.rows = rows
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+
+        return self.sourceModel().rowCount() if self.rows is None else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else 1
+
+    def index(self, row, column, parent=QModelIndex()):
+        if parent.isValid() or row < 0 or column != 0 or row >= self.rowCount():
+            return QModelIndex()
+
+        return self.createIndex(row, column)
+
+    def parent(self, index=None):
+        #* Without an index this is QObject.parent
+        if index is None:
+            return super().parent()
+
+        return QModelIndex()
+
+    def mapToSource(self, proxy_index):
+        if not proxy_index.isValid():
+            return QModelIndex()
+
+        row = proxy_index.row() if self.rows is None else self.rows[proxy_index.row()]
+        return self.sourceModel().index(row, proxy_index.column())
+
+    def mapFromSource(self, source_index):
+        if not source_index.isValid():
+            return QModelIndex()
+
+        row = source_index.row()
+        if self.rows is not None:
+            position = bisect.bisect_left(self.rows, row)
+            if position >= len(self.rows) or self.rows[position] != row:
+                return QModelIndex()
+            row = position
+
+        return self.index(row, source_index.column())
+
+class SearchableElementEditor(QWidget):
+    #* Wait for a pause in typing before searching
+    SEARCH_DELAY_MS = 150
+
+    def __init__(self, model: QAbstractListModel, editor: QWidget, parent=None):
+        super().__init__(parent)
+
+        self.model = model
+        self.editor = editor
+
+        #* Built on the first search and dropped when the model changes
+        self.search_index: Optional[helper.SubstringIndex] = None
+
+        self.proxy = RowFilterProxyModel(self)
+        self.proxy.setSourceModel(self.model)
+
+        #* Keep the search and the current element when the model gets reset
+        self.reset_key = None
+        self.model.modelAboutToBeReset.connect(self.remember_current)
+        self.model.modelReset.connect(self.restore_current)
 
         #* create the main layout elements
         self.main_layout = QHBoxLayout()
         self.search_box = QLineEdit()
         self.search_box.setPlaceholderText("Search tags...")
 
-        self.list_widget = QListWidget()
-        self.stack_widget = QStackedWidget()
+        self.list_view = QListView()
+        self.list_view.setModel(self.proxy)
+        self.list_view.setUniformItemSizes(True)
+
+        #* A single editor is reused for every element
+        self.editor_area = QScrollArea()
+        self.editor_area.setWidgetResizable(True)
+        self.editor_area.setWidget(self.editor)
 
-        #* Hook search to filter
-        self.search_box.textChanged.connect(self.filter_list)
+        #* Hook search to filter, debounced
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(self.SEARCH_DELAY_MS)
+        self.search_timer.timeout.connect(self.filter_list)
+        self.search_box.textChanged.connect(self.search_timer.start)
 
-        #* Hook selection to stack
-        self.list_widget.currentRowChanged.connect(self.stack_widget.setCurrentIndex)
+        #* Hook selection to the editor, the editor works with source rows
+        self.list_view.selectionModel().currentRowChanged.connect(lambda current, previous: self.select_row(self.proxy.mapToSource(current).row()))
 
         #* Link the layouts elements
         left_layout = QVBoxLayout()
         left_layout.addWidget(self.search_box)
-        left_layout.addWidget(self.list_widget)
+        left_layout.addWidget(self.list_view)
 
         self.main_layout.addLayout(left_layout, 1)
-        self.main_layout.addWidget(self.stack_widget, 2)
+        self.main_layout.addWidget(self.editor_area, 2)
 
         self.setLayout(self.main_layout)
 
-    def add_element(self, label: str, widget):
-        #* Add a new item to the list and stack
-        index = bisect.bisect_left(self.label_list, label.lower())
+    def select_row(self, row: int):
+        pass
 
-        self.list_widget.insertItem(index, label)
-        self.stack_widget.insertWidget(index, widget)
-        self.label_list.insert(index, label.lower())
+    def current_key(self):
+        current_source_index = self.proxy.mapToSource(self.list_view.currentIndex())
+        return self.model.key(current_source_index.row()) if current_source_index.isValid() else None
+
+    def remember_current(self):
+        self.reset_key = self.current_key()
+
+    def restore_current(self):
+        self.search_index = None
+        self.apply_filter(self.reset_key)
+
+    def filter_list(self):
+        self.apply_filter(self.current_key())
+
+    def apply_filter(self, current_key):
+        if self.search_index is None:
+            self.search_index = helper.SubstringIndex(self.model.labels())
 
-    def filter_list(self, text):
         #* Filter the list based on the search text
-        for i in range(self.list_widget.count()):
-            item = self.list_widget.item(i)
-            item.setHidden(text.lower() not in item.text().lower())
-
-        #* If the current item is hidden, select the first visible item
-        selected_item = self.list_widget.currentItem()
-        if selected_item and selected_item.isHidden():
-            for i in range(self.list_widget.count()):
-                if not self.list_widget.item(i).isHidden():
-                    self.list_widget.setCurrentRow(i)
-                    break
+        self.proxy.set_rows(self.search_index.search(self.search_box.text()))
 
-        #* Scroll to the selected item
-        selected_item = self.list_widget.currentItem()
-        if selected_item:
-            self.list_widget.scrollToItem(selected_item, QAbstractItemView.PositionAtCenter)
+        if current_key is None:
+            return
 
+        #* Keep the current item if it is still visible, else select the first visible item
+        current_index = self.proxy.mapFromSource(self.model.index(self.model.row_of(current_key), 0))
+        if not current_index.isValid():
+            current_index = self.proxy.index(0, 0)
+        if current_index.isValid():
+            self.list_view.setCurrentIndex(current_index)
 
-class SearchableTagEditor(SearchableElementEditor):
-    def __init__(self, tags: list[tag_util.Tag], parent=None):
-        super().__init__(parent)
+        #* Scroll to the selected item
+        current_index = self.list_view.currentIndex()
+        if current_index.isValid():
+            self.list_view.scrollTo(current_index, QAbstractItemView.PositionAtCenter)
 
-        self.tags = tags
-        self.loaded_tags: list = list()
-        self.loaded_ids: set[int] = set()
 
-        self.list_widget.currentRowChanged.connect(self.lazy_load_tag)
+class SearchableTagEditor(SearchableElementEditor):
+    def __init__(self, parent=None):
+        super().__init__(TagListModel(), TagEdit(), parent)
 
-    def add_label(self, label):
-        #* Add a new item to the list and stack
-        index = bisect.bisect_left(self.label_list, label.lower())
+        #* Tags whose settings were changed in the editor, keyed by descriptor
+        self.dirty_tags: dict[str, tag_util.Tag] = dict()
 
-        self.list_widget.insertItem(index, label)
-        self.stack_widget.insertWidget(index, QWidget())
-        self.label_list.insert(index, label.lower())
+        #* Only a complete catalogue shows which settings belong to removed tags
+        self.catalogue_complete = False
 
-    def lazy_load_tag(self, index: int):
-        cur_widget = self.stack_widget.widget(index)
+    def load(self, db):
+        '''
+        Load the tags in a background thread, the list fills up column by column
+        '''
+        self.search_box.setPlaceholderText("Loading tags...")
+        self.editor.db = db
 
-        if not index in self.loaded_ids:
-            tag_name: str = self.label_list[index]
+        loader = TagLoader(db)
+        loader.column_loaded.connect(self.model.add_tags)
+        loader.counts_loaded.connect(self.counts_loaded)
+        loader.book_index_loaded.connect(self.editor.set_book_index)
+        loader.loading_done.connect(self.loading_finished)
 
-            for tag in self.tags:
-                if tag.name == tag_name:
-                    break
+        #* Stop after the current column if the dialog gets closed
+        running_loaders.add(loader)
+        loader.finished.connect(lambda: running_loaders.discard(loader))
+        self.destroyed.connect(loader.requestInterruption)
 
-            scroll = QScrollArea(self.stack_widget)
-            scroll.setWidgetResizable(True)
+        loader.start()
 
-            tag_widget = TagEdit(tag, scroll)
+    def counts_loaded(self, counts: dict[str, int]):
+        self.model.set_usage_counts(counts)
 
-            for name_alias in tag.name_aliases:
-                tag_widget.name_aliases.add_row(value=name_alias)
+        self.editor.counts_loaded = True
+        self.editor.update_title()
 
-            for add_tag in tag.add_tags:
-                tag_widget.add_tags.add_row(value=add_tag)
+    def loading_finished(self, complete: bool):
+        self.catalogue_complete = complete
+        self.search_box.setPlaceholderText("Search tags...")
 
-            scroll.setWidget(tag_widget)
+    def commit_editor(self):
+        #* Only tags whose settings changed get saved
+        tag_obj = self.editor.tag_obj
+        if self.editor.commit():
+            self.dirty_tags[tag_obj.get_descriptor()] = tag_obj
 
-            self.stack_widget.removeWidget(self.stack_widget.widget(index))
-            self.stack_widget.insertWidget(index, scroll)
+    def select_row(self, row: int):
+        #* Keep the changes of the previous tag before the editor gets rebound
+        self.commit_editor()
 
-            self.loaded_ids.add(index)
-            self.loaded_tags.insert(index, tag_widget)
+        if row < 0:
+            self.editor.bind(None)
+            return
 
-        self.stack_widget.setCurrentIndex(index)
+        self.editor.bind(self.model.tag(row))
+        self.editor_area.verticalScrollBar().setValue(0)
 
     def save(self):
-        #* Cop the tags from the prefs
-        pref_tags: dict = prefs.get('tags', dict()).copy()
+        #* Write the changes of the shown tag to its tag object
+        self.commit_editor()
 
-        #* Save the settings for the tag details
-        for i in range(len(self.loaded_tags)):
-            tag_widget: TagEdit = self.loaded_tags[i]
+        #* Entries to write, None deletes the entry
+        updates: dict[str, Optional[dict]] = dict()
 
-            tag_obj = tag_widget.tag_obj
-            tag_descriptor = tag_obj.get_descriptor()
+        #* Save the settings for the tag details
+        for tag_descriptor, tag_obj in self.dirty_tags.items():
+            tag_entry: dict = settings.rules.get(tag_descriptor) or dict()
 
             #* Set names
-            pref_tags.setdefault(tag_descriptor, dict())['display_name'] = tag_obj.display_name
-            pref_tags.setdefault(tag_descriptor, dict())['name'] = tag_obj.name
-
-            #* Get the name aliases
-            tag_name_aliases = list()
-            for name_alias in tag_widget.name_aliases.edits:
-                if name_alias.text().strip().lower() != '':
-                    tag_name_aliases.append(name_alias.text().strip().lower())
+            tag_entry['display_name'] = tag_obj.display_name
+            tag_entry['name'] = tag_obj.name
 
-            #* Get the add tags
-            tag_add_tags = list()
-            for add_tag in tag_widget.add_tags.edits:
-                if add_tag.text().strip() != '':
-                    tag_add_tags.append(add_tag.text().strip())
+            tag_name_aliases = tag_obj.name_aliases
+            tag_add_tags = tag_obj.add_tags
+            tag_split_tag = tag_obj.split_tag
 
-            #* Get split_tag
-            tag_split_tag = tag_widget.split_tag.isChecked()
-
-            #* Save the tag alias, if there are none, remove the tag from the prefs
+            #* Save the tag alias, if there are none, remove them from the entry
             if len(tag_name_aliases) > 0:
-                pref_tags.setdefault(tag_descriptor, dict())['name_aliases'] = tag_name_aliases
+                tag_entry['name_aliases'] = list(tag_name_aliases)
             else:
-                pref_tags.setdefault(tag_descriptor, dict()).pop('name_aliases', None)
+                tag_entry.pop('name_aliases', None)
 
-            #* Save the add tags, if there are none, remove the tag from the prefs
+            #* Save the add tags, if there are none, remove them from the entry
             if len(tag_add_tags) > 0:
-                pref_tags.setdefault(tag_descriptor, dict())['add_tags'] = tag_add_tags
+                tag_entry['add_tags'] = list(tag_add_tags)
             else:
-                pref_tags.setdefault(tag_descriptor, dict()).pop('add_tags', None)
+                tag_entry.pop('add_tags', None)
 
             #* Save split_tag_auto
             if tag_split_tag:
-                pref_tags.setdefault(tag_descriptor, dict()).pop('split_tag_auto', None)
+                tag_entry.pop('split_tag_auto', None)
             else:
-                pref_tags.setdefault(tag_descriptor, dict())['split_tag_auto'] = False
+                tag_entry['split_tag_auto'] = False
 
             #* Remove entry if all settings are the default
             if len(tag_name_aliases) <= 0 and len(tag_add_tags) <= 0 and tag_split_tag:
-                pref_tags.pop(tag_descriptor, None)
+                updates[tag_descriptor] = None
+            else:
+                updates[tag_descriptor] = tag_entry
 
 
         #* Remove entries that aren't tags anymore
-        pref_tags_to_remove: list[str] = list()
-        for pref_tag_name, pref_tag_data in pref_tags.items():
-            if not any(pref_tag_data['name'] == tag.name for tag in self.tags):
-                pref_tags_to_remove.append(pref_tag_name)
-
-        for remove_name in pref_tags_to_remove:
-            pref_tags.pop(remove_name)
+        if self.catalogue_complete:
+            tag_names: set[str] = {tag.name for tag in self.model.tags}
+            for tag_descriptor, tag_name in settings.rules.names().items():
+                if not tag_name in tag_names:
+                    updates[tag_descriptor] = None
 
+        #* Only the changed entries are written
+        if updates:
+            settings.rules.update(updates)
 
-        #* Reassign the tags to the prefs, else the save to disc is not triggered
-        prefs['tags'] = pref_tags
+        self.dirty_tags.clear()
 
 
 
 class ListEdit(QWidget):
+    #* Emitted when a row is added, removed or edited
+    changed = pyqtSignal()
+
     def __init__(self, parent=None, title:str = ''):
         super().__init__(parent)
 
-        self.edits = list()
+        self.edits: list[QLineEdit] = list()
 
         #* create the main layout elements
         self.main_layout = QVBoxLayout(self)
         self.title = QLabel(title)
-        self.list = QVBoxLayout(self)
+        self.list = QVBoxLayout()
         self.add_button = QPushButton("Add Row", self)
 
         #* Connect the add button to the add_row method
@@ -273,83 +473,221 @@ class ListEdit(QWidget):
         self.setLayout(self.main_layout)
 
     def add_row(self, *, value:str = ''):
+        column_name_edit = self.create_row(value)
+
+        #* Set focus on new element
+        column_name_edit.setFocus()
+
+    def create_row(self, value: str) -> QLineEdit:
         #* create the main layout elements
-        main_layout = QHBoxLayout(self)
-        column_name_edit = QLineEdit(value, self)
-        del_button = QPushButton("Delete", self)
+        row = QWidget(self)
+        main_layout = QHBoxLayout(row)
+        column_name_edit = QLineEdit(value, row)
+        del_button = QPushButton("Delete", row)
+
+        main_layout.setContentsMargins(0, 0, 0, 0)
 
         #* design the del button
         del_button.setStyleSheet("background-color: red; color: white;")
 
         #* Connect the del button
-        del_button.clicked.connect(lambda: (main_layout.removeWidget(column_name_edit),
-                                            self.edits.remove(column_name_edit),
-                                            column_name_edit.deleteLater(),
-                                            main_layout.removeWidget(del_button),
-                                            del_button.deleteLater(),
-                                            self.list.removeItem(main_layout),
-                                            main_layout.setParent(None),
-                                            main_layout.deleteLater()))
+        del_button.clicked.connect(lambda: self.remove_row(column_name_edit))
+        column_name_edit.textChanged.connect(self.changed)
 
         #* Link the layouts elements
         main_layout.addWidget(column_name_edit, 5)
         main_layout.addWidget(del_button, 1)
 
-        #* Add the QLineEdit widgets to the line
-        self.list.addLayout(main_layout)
+        #* Add the row to the list
+        self.list.addWidget(row)
 
         #* Add the QLineEdit widgets to the column_edits list
         self.edits.append(column_name_edit)
+        self.changed.emit()
 
-        #* Set focus on new element
-        column_name_edit.setFocus()
+        return column_name_edit
+
+    def remove_row(self, column_name_edit: QLineEdit):
+        row = column_name_edit.parentWidget()
+
+        self.edits.remove(column_name_edit)
+        self.list.removeWidget(row)
+        row.deleteLater()
+        self.changed.emit()
+
+    def set_values(self, values: list[str]):
+        #* Replace all rows, used when the editor gets rebound
+        for column_name_edit in list(self.edits):
+            self.remove_row(column_name_edit)
+
+        for value in values:
+            self.create_row(value)
+
+    def values(self) -> list[str]:
+        return [edit.text().strip() for edit in self.edits if edit.text().strip() != '']
 
 
 class TagEdit(QWidget):
-    def __init__(self, tag_obj: tag_util.Tag, parent=None):
+    '''
+    Editor for the settings of one tag, rebound to the selected tag instead of creating one editor per tag
+    '''
+    def __init__(self, parent=None):
         super().__init__(parent)
 
-        self.tag_obj: tag_util.Tag = tag_obj
+        self.tag_obj: Optional[tag_util.Tag] = None
+
+        #* The usage counts and the book index are loaded after the tags
+        self.counts_loaded = False
+        self.db = None
+        self.book_index: Optional[dict[str, set[int]]] = None
+
+        #* Rules of every tag when it was shown first, the preview compares against them
+        self.saved_rules: dict[str, tuple[tuple[str, ...], tuple[str, ...]]] = dict()
 
         #* create the layout elements
         self.main_layout = QVBoxLayout()
         self.title_layout = QHBoxLayout()
-        self.title = QLabel(f'Settings for tag: \'{tag_obj.display_name}\'\nFrom column: \'{tag_obj.collection_name}\'\nUsed by {tag_obj.in_book_count} {"book" if tag_obj.in_book_count == 1 else "books"}')
+        self.title = QLabel()
+        self.impact = QLabel()
         self.copy_button = QToolButton()
-        self.split_tag_layout = QHBoxLayout()
+        self.split_tag_row = QWidget()
+        self.split_tag_layout = QHBoxLayout(self.split_tag_row)
         self.split_tag_label = QLabel('Split tag automatically?')
         self.split_tag = QCheckBox()
         self.name_aliases = ListEdit(self, 'Name aliases')
         self.add_tags = ListEdit(self, 'Add tags')
 
-        #* Set split tag default
-        self.split_tag.setChecked(tag_obj.split_tag)
-
         #* Link copy button click event
         self.copy_button.setIcon(get_icons('images/copy.png', 'Tag Sync')) # type: ignore
-        self.copy_button.clicked.connect(lambda: QApplication.clipboard().setText(tag_obj.display_name))
+        self.copy_button.clicked.connect(lambda: QApplication.clipboard().setText(self.tag_obj.display_name) if self.tag_obj else None)
+
+        #* Update the rule impact preview after a pause in editing
+        self.preview_timer = QTimer(self)
+        self.preview_timer.setSingleShot(True)
+        self.preview_timer.setInterval(SearchableElementEditor.SEARCH_DELAY_MS)
+        self.preview_timer.timeout.connect(self.update_preview)
+        self.name_aliases.changed.connect(self.preview_timer.start)
+        self.add_tags.changed.connect(self.preview_timer.start)
+        self.split_tag.toggled.connect(self.preview_timer.start)
+
+        self.impact.setWordWrap(True)
 
         #* Link the layouts elements
         self.title_layout.addWidget(self.title)
         self.title_layout.addStretch()
         self.title_layout.addWidget(self.copy_button, alignment=Qt.AlignTop | Qt.AlignRight)
 
+        self.split_tag_layout.setContentsMargins(0, 0, 0, 0)
         self.split_tag_layout.addWidget(self.split_tag_label)
         self.split_tag_layout.addWidget(self.split_tag)
         self.split_tag_layout.addStretch()
 
         self.main_layout.addLayout(self.title_layout)
-
-        #* Hide the split_tag checkbox if split is not possible
-        if re.match(r'[^\(]*\(([^\)]*?)\).*', tag_obj.name):
-            self.main_layout.addLayout(self.split_tag_layout)
-
+        self.main_layout.addWidget(self.impact)
+        self.main_layout.addWidget(self.split_tag_row)
         self.main_layout.addWidget(self.name_aliases)
         self.main_layout.addWidget(self.add_tags)
         self.main_layout.addStretch()
 
         self.setLayout(self.main_layout)
 
+        self.bind(None)
+
+    def bind(self, tag_obj: Optional[tag_util.Tag]):
+        self.tag_obj = tag_obj
+
+        #* Nothing selected, show an empty editor
+        self.setEnabled(tag_obj is not None)
+        if tag_obj is None:
+            self.title.setText('Select a tag to edit its settings')
+            self.split_tag_row.hide()
+            self.name_aliases.set_values(list())
+            self.add_tags.set_values(list())
+            return
+
+        self.update_title()
+
+        #* Set split tag default
+        self.split_tag.setChecked(tag_obj.split_tag)
+
+        #* Hide the split_tag checkbox if split is not possible
+        self.split_tag_row.setVisible(re.match(r'[^\(]*\(([^\)]*?)\).*', tag_obj.name) is not None)
+
+        self.saved_rules.setdefault(tag_obj.name, (tag_obj.name_aliases, tag_obj.add_tags))
+
+        self.name_aliases.set_values(tag_obj.name_aliases)
+        self.add_tags.set_values(tag_obj.add_tags)
+
+        self.update_preview()
+
+    def set_book_index(self, book_index: dict[str, set[int]]):
+        self.book_index = book_index
+        self.update_preview()
+
+    def update_preview(self):
+        '''
+        Show how many books the edited rules change, compared to the saved rules
+        '''
+        self.preview_timer.stop()
+
+        if self.tag_obj is None or self.book_index is None:
+            self.impact.clear()
+            return
+
+        old_aliases, old_add_tags = self.saved_rules[self.tag_obj.name]
+        new_aliases = tuple(name_alias.lower() for name_alias in self.name_aliases.values())
+        new_add_tags = tuple(self.add_tags.values())
+
+        #* The next sync adds the split parts of the name if splitting is on
+        split_parts = tag_util.split_display_name(self.tag_obj.display_name) if self.split_tag.isChecked() else None
+        if split_parts:
+            new_aliases += (split_parts[0].lower(),)
+            new_add_tags += (split_parts[1],)
+
+        affected = tag_util.rule_impact(self.book_index, self.tag_obj.name, old_aliases, old_add_tags, new_aliases, new_add_tags)
+
+        if not affected:
+            self.impact.clear()
+            return
+
+        #* A few titles as example, looked up only for the shown books
+        sample = [self.db.field_for('title', book_id) for book_id in sorted(affected)[:PREVIEW_SAMPLE_SIZE]]
+        more = f'\n  and {len(affected) - len(sample)} more' if len(affected) > len(sample) else ''
+
+        self.impact.setText(f'This change affects {len(affected)} {"book" if len(affected) == 1 else "books"}:\n  ' + '\n  '.join(sample) + more)
+
+    def update_title(self):
+        tag_obj = self.tag_obj
+        if tag_obj is None:
+            return
+
+        if self.counts_loaded:
+            usage = f'Used by {tag_obj.in_book_count} {"book" if tag_obj.in_book_count == 1 else "books"}'
+        else:
+            usage = 'Counting books...'
+
+        self.title.setText(f'Settings for tag: \'{tag_obj.display_name}\'\nFrom column: \'{tag_obj.collection_name}\'\n{usage}')
+
+    def commit(self) -> bool:
+        '''
+        Write the edited values back to the bound tag object, returns whether they changed
+        '''
+        if self.tag_obj is None:
+            return False
+
+        name_aliases = tuple(name_alias.lower() for name_alias in self.name_aliases.values())
+        add_tags = tuple(self.add_tags.values())
+        split_tag = self.split_tag.isChecked()
+
+        if name_aliases == self.tag_obj.name_aliases and add_tags == self.tag_obj.add_tags and split_tag == self.tag_obj.split_tag:
+            return False
+
+        self.tag_obj.name_aliases = name_aliases
+        self.tag_obj.add_tags = add_tags
+        self.tag_obj.split_tag = split_tag
+
+        return True
+
 class ColumnSelect(QWidget):
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -426,7 +764,7 @@ class ColumnSelect(QWidget):
         #* Add custom columns
         columns = dict()
         columns['tags'] = None
-        columns.update(helper.get_custom_column(gui))
+        columns.update(helper.get_custom_column(helper.get_db(gui)))
         for name, data in columns.items():
             if name != 'tags':
                 if data.get('datatype', '') != 'text':
@@ -451,7 +789,7 @@ class ColumnSelect(QWidget):
 
         self.main_layout.addStretch()
 
-        prefs_column = prefs.get('columns', dict())
+        prefs_column = settings.prefs.get('columns', dict())
         for name, inputs in self.selections.items():
             pref_data = prefs_column.get(name, dict())
 
@@ -467,4 +805,78 @@ class ColumnSelect(QWidget):
                 'prio': data['prio'].value(),
             }
 
-        prefs['columns'] = result
+        settings.prefs['columns'] = result
+
+
+class OptionsWidget(QWidget):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+
+        #* create the layout elements
+        self.main_layout = QVBoxLayout()
+        self.collect_stats = QCheckBox('Collect sync statistics')
+        self.collect_stats.setToolTip(
+            '''
+            <html>
+                Measures the time of every sync phase and counts the processed books and rule hits.<br />
+                The statistics are shown in the details of the sync result and written to the calibre log.
+            </html>
+            '''
+        )
+
+        self.collect_stats.setChecked(settings.prefs['collect_stats'])
+
+        self.merge_aliases = QCheckBox('Merge aliases within a column')
+        self.merge_aliases.setToolTip(
+            '''
+            <html>
+                If an alias and its tag are in the same column, the alias is renamed to the tag in one step for all books,
+                instead of rewriting every book. The alias disappears from the column.<br />
+                Moves to other columns and add tags are still written book by book.
+            </html>
+            '''
+        )
+        self.merge_aliases.setChecked(settings.prefs['merge_aliases'])
+
+        self.chunk_size_row = QWidget()
+        self.chunk_size_layout = QHBoxLayout(self.chunk_size_row)
+        self.chunk_size_label = QLabel('Books per chunk')
+        self.chunk_size = QSpinBox()
+        self.chunk_size.setRange(100, 100000)
+        self.chunk_size.setSingleStep(100)
+        self.chunk_size.setToolTip(
+            '''
+            <html>
+                Number of books that are read, synced and written together.<br />
+                Smaller chunks need less memory and can be cancelled sooner, larger chunks are a bit faster.
+            </html>
+            '''
+        )
+        self.chunk_size.setValue(settings.prefs['chunk_size'])
+
+        self.export_button = QPushButton('Export rules...')
+        self.export_button.setToolTip('Save the rules of all tags as JSON file')
+        self.export_button.clicked.connect(self.export_rules)
+
+        #* Link the layouts elements
+        self.main_layout.addWidget(self.collect_stats)
+        self.main_layout.addWidget(self.merge_aliases)
+        self.chunk_size_layout.setContentsMargins(0, 0, 0, 0)
+        self.chunk_size_layout.addWidget(self.chunk_size_label)
+        self.chunk_size_layout.addWidget(self.chunk_size)
+        self.chunk_size_layout.addStretch()
+        self.main_layout.addWidget(self.chunk_size_row)
+        self.main_layout.addWidget(self.export_button, alignment=Qt.AlignLeft)
+        self.main_layout.addStretch()
+
+        self.setLayout(self.main_layout)
+
+    def export_rules(self):
+        path, _filter = QFileDialog.getSaveFileName(self, 'Export rules', 'tag_sync_rules.json', 'JSON files (*.json)')
+        if path:
+            settings.rules.export_json(path)
+
+    def save(self):
+        settings.prefs['collect_stats'] = self.collect_stats.isChecked()
+        settings.prefs['merge_aliases'] = self.merge_aliases.isChecked()
+        settings.prefs['chunk_size'] = self.chunk_size.value()
@@ -1,56 +1,101 @@
-from . import config
+from . import settings
 from calibre.db.cache import Cache as DB
-from calibre.gui2 import info_dialog, question_dialog, warning_dialog, error_dialog
-from calibre.gui2.ui import Main as GUI
-from typing import Optional
+from typing import Optional, TYPE_CHECKING
+import os
 
-def get_db(gui: GUI) -> DB:
+#* Only import the GUI for type hints, the sync helpers must work headless
+if TYPE_CHECKING:
+    from calibre.gui2.ui import Main as GUI
+
+def get_db(gui: 'GUI') -> DB:
     return gui.current_db.new_api
 
 
-def get_custom_column(gui: GUI) -> dict:
-    return gui.library_view.model().custom_columns
+def get_custom_column(db: DB) -> dict:
+    return db.field_metadata.custom_field_metadata()
 
 
-def get_selected_columns(gui: GUI) -> list:
-    column_names: list = list(get_custom_column(gui).keys())
+def get_selected_columns(db: DB) -> list:
+    column_names: list = list(get_custom_column(db).keys())
 
     column_names.append('tags')
 
-    return [name for name in column_names if name in config.prefs.get('columns', dict())]
+    return [name for name in column_names if name in settings.prefs.get('columns', dict())]
 
 
 def get_all_field_values(db: DB, field_name: str) -> list[(int, str)]:
-    id_map = db.fields[field_name].table.id_map
-    fields = [(id, id_map[id]) for id in db.fields[field_name]]
-    return fields
+    #* `get_id_map` copies the items under the read lock, the GUI can change the table meanwhile
+    return list(db.get_id_map(field_name).items())
+
+
+def write_atomic(path: str, data, mode: str = 'w'):
+    '''
+    Write to a temporary file first and replace `path` with it, an interrupted write leaves the old file intact
+    '''
+    temp_path = f'{path}.tmp'
+    with open(temp_path, mode, encoding=None if 'b' in mode else 'utf-8') as file:
+        file.write(data)
+    os.replace(temp_path, path)
+
+
+class SubstringIndex:
+    '''
+    Lowercase labels prepared once for substring searches.
+    When the text extends the previous search, only the previous matches get checked again.
+    '''
+    def __init__(self, labels: list[str]):
+        self.labels      : list[str]           = [label.lower() for label in labels]
+        self.last_text   : str                 = ''
+        self.last_matches: Optional[list[int]] = None
+
+    def search(self, text: str) -> Optional[list[int]]:
+        '''
+        Sorted positions of the labels containing `text`, None if every label matches
+        '''
+        text = text.lower()
+
+        if not text:
+            matches = None
+        elif self.last_matches is not None and self.last_text in text:
+            matches = [position for position in self.last_matches if text in self.labels[position]]
+        else:
+            matches = [position for position, label in enumerate(self.labels) if text in label]
+
+        self.last_text = text
+        self.last_matches = matches
+
+        return matches
 
 
 class Dialog:
     _instance = None
 
-    def __init__(self, gui: GUI):
+    def __init__(self, gui: 'GUI'):
         self.gui = gui
 
     def info(self, title:str, msg: str, detail_msg: Optional[str]=None):
+        from calibre.gui2 import info_dialog
         if detail_msg:
             return info_dialog(self.gui, title, msg, detail_msg, show=True, only_copy_details=True)
         else:
             return info_dialog(self.gui, title, msg, show=True)
 
     def question(self, title:str, msg: str, detail_msg: Optional[str]=None):
+        from calibre.gui2 import question_dialog
         if detail_msg:
             return question_dialog(self.gui, title, msg, detail_msg)
         else:
             return question_dialog(self.gui, title, msg)
 
     def warning(self, title:str, msg: str, detail_msg: Optional[str]=None):
+        from calibre.gui2 import warning_dialog
         if detail_msg:
             return warning_dialog(self.gui, title, msg, detail_msg, show=True, only_copy_details=True)
         else:
             return warning_dialog(self.gui, title, msg, show=True)
 
     def error(self, title:str, msg: str, detail_msg: Optional[str]=None):
+        from calibre.gui2 import error_dialog
         if detail_msg:
             return error_dialog(self.gui, title, msg, detail_msg, show=True, only_copy_details=True)
         else:
@@ -64,6 +109,6 @@ class Dialog:
         return cls._instance
 
     @classmethod
-    def create(cls, gui: GUI):
+    def create(cls, gui: 'GUI'):
         if not cls._instance:
             cls._instance = Dialog(gui)
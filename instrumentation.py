@@ -0,0 +1,55 @@
+from contextlib import contextmanager, nullcontext
+from time import perf_counter
+import logging
+
+class SyncStats:
+    '''
+    Wall time per phase and counters of one sync run.
+    A disabled instance skips all bookkeeping, so it can be passed around unconditionally.
+    '''
+    def __init__(self, enabled: bool = True):
+        self.enabled    : bool             = enabled
+        self.phase_times: dict[str, float] = dict()
+        self.counters   : dict[str, int]   = dict()
+
+    def phase(self, name: str):
+        if not self.enabled:
+            return nullcontext()
+
+        return self._timed_phase(name)
+
+    @contextmanager
+    def _timed_phase(self, name: str):
+        start_time = perf_counter()
+        try:
+            yield
+        finally:
+            #* Phases run once per chunk are summed up
+            self.phase_times[name] = self.phase_times.get(name, 0.0) + perf_counter() - start_time
+
+    def count(self, name: str, value: int = 1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def report(self) -> str:
+        lines: list[str] = list()
+
+        if self.phase_times:
+            lines.append('Phases:')
+            for name, seconds in self.phase_times.items():
+                lines.append(f'  {name:<22} {seconds:>9.3f} s')
+
+        if self.counters:
+            lines.append('Counters:')
+            for name, value in self.counters.items():
+                lines.append(f'  {name:<22} {value:>9}')
+
+        return '\n'.join(lines)
+
+    def log(self, logger: logging.Logger):
+        if self.enabled:
+            logger.info(f'Tag Sync statistics\n{self.report()}')
+
+
+#* Shared instance for callers that don't collect statistics
+DISABLED = SyncStats(enabled=False)
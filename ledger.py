@@ -0,0 +1,86 @@
+from . import helper, tag_util
+from typing import Self
+import hashlib
+import json
+import os
+
+#* Kept in the library folder, deleting it only makes the next incremental sync a full one
+LEDGER_FILE_NAME = 'tag_sync_ledger.json'
+LEDGER_VERSION = 1
+
+def digest(value: str) -> str:
+    return hashlib.blake2b(value.encode('utf-8'), digest_size=8).hexdigest()
+
+
+def fingerprint(column_values: list[tuple[str, ...]]) -> str:
+    '''
+    Order-insensitive hash of the synced columns of one book
+    '''
+    return digest('\x1e'.join('\x1f'.join(sorted(set(values))) for values in column_values))
+
+
+def rule_signatures(tag_rules: tag_util.TagRules, columns: list[str]) -> dict[str, str]:
+    '''
+    Hash the effect the rules have on every tag name and alias on its own.
+    The rules act on every tag of a book independently, so a book is only
+    affected by a rule change if one of its tags has a changed signature.
+    '''
+    signatures: dict[str, str] = dict()
+
+    for key in [*tag_rules.tags, *tag_rules.alias_index]:
+        if key not in signatures:
+            signatures[key] = fingerprint(list(tag_rules.apply_to_tags(columns, [key]).values()))
+
+    return signatures
+
+
+def rules_version(signatures: dict[str, str]) -> str:
+    return digest('\x1e'.join(f'{key}\x1f{signature}' for key, signature in sorted(signatures.items())))
+
+
+class Ledger:
+    '''
+    Fingerprints of the synced columns of every book and the rules they were synced with
+    '''
+    def __init__(self, path: str):
+        self.path           : str            = path
+        self.rules_version  : str            = ''
+        self.rule_signatures: dict[str, str] = dict()
+        self.fingerprints   : dict[int, str] = dict()
+
+    def changed_keys(self, signatures: dict[str, str]) -> set[str]:
+        #* Tag names and aliases whose rules changed, were added or were removed since the last run
+        keys = {key for key, signature in signatures.items() if self.rule_signatures.get(key) != signature}
+        keys.update(self.rule_signatures.keys() - signatures.keys())
+
+        return keys
+
+    def save(self):
+        data = {
+            'version': LEDGER_VERSION,
+            'rules_version': self.rules_version,
+            'rule_signatures': self.rule_signatures,
+            'fingerprints': self.fingerprints,
+        }
+
+        helper.write_atomic(self.path, json.dumps(data, separators=(',', ':')))
+
+    @classmethod
+    def load(cls, library_path: str) -> Self:
+        ledger = Ledger(os.path.join(library_path, LEDGER_FILE_NAME))
+
+        try:
+            with open(ledger.path, 'r', encoding='utf-8') as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            #* No usable ledger, every book counts as changed
+            return ledger
+
+        if data.get('version') != LEDGER_VERSION:
+            return ledger
+
+        ledger.rules_version = data.get('rules_version', '')
+        ledger.rule_signatures = data.get('rule_signatures', dict())
+        ledger.fingerprints = {int(book_id): value for book_id, value in data.get('fingerprints', dict()).items()}
+
+        return ledger
@@ -0,0 +1,121 @@
+from . import helper, instrumentation, settings, tag_util
+from calibre.db.cache import Cache as DB
+from typing import Optional
+import gc
+import hashlib
+import json
+import logging
+import os
+import sys
+import zlib
+
+logger = logging.getLogger(__name__)
+
+#* Next to the rule store, a cache only, it is rebuilt when missing
+SNAPSHOT_FILE_NAME = 'tag_sync_rules.snapshot'
+SNAPSHOT_VERSION = 1
+
+def snapshot_key(db: DB) -> str:
+    '''
+    Hash of everything the compiled rules depend on: the column settings,
+    the tag rules and the items of the synced columns
+    '''
+    hasher = hashlib.blake2b(digest_size=16)
+    hasher.update(json.dumps([SNAPSHOT_VERSION, settings.prefs['columns']], sort_keys=True).encode('utf-8'))
+    hasher.update(settings.rules.digest().encode('utf-8'))
+
+    for column in helper.get_selected_columns(db):
+        items = sorted(db.get_id_map(column).items())
+        hasher.update(f'\x1d{column}\x1d'.encode('utf-8'))
+        hasher.update('\x1e'.join(f'{item_id}\x1f{name}' for item_id, name in items).encode('utf-8'))
+
+    return hasher.hexdigest()
+
+
+def to_data(tag_rules: tag_util.TagRules) -> dict:
+    #* Plain lists and dicts only, the snapshot must not be able to run code when loaded
+    #* Tags are referenced by their position, that keeps the snapshot small and fast to parse
+    positions: dict[str, int] = {tag_name: position for position, tag_name in enumerate(tag_rules.tags)}
+
+    return {
+        'tags': [[tag.display_name, tag.collection_name, tag.id, tag.prio, tag.split_tag, tag.name_aliases, tag.add_tags]
+                 for tag in tag_rules.tags.values()],
+        'alias_index': {alias: [positions[tag_name] for tag_name in tag_names] for alias, tag_names in tag_rules.alias_index.items()},
+        'add_tags_closure': [[positions[tag_name] for tag_name in tag_rules.add_tags_closure.get(tag_name, ())] for tag_name in tag_rules.tags],
+        'cycles': tag_rules.cycles,
+    }
+
+
+def from_data(data: dict) -> tag_util.TagRules:
+    tag_rules = tag_util.TagRules()
+
+    for display_name, collection_name, tag_id, prio, split_tag, name_aliases, add_tags in data['tags']:
+        tag = tag_util.Tag(display_name, collection_name, tag_id)
+        tag.prio = prio
+        tag.split_tag = split_tag
+        tag.name_aliases = tuple(sys.intern(name_alias) for name_alias in name_aliases)
+        tag.add_tags = tuple(add_tags)
+
+        tag_rules.tags[tag.name] = tag
+
+    #* The names of the tags are interned, the indexes share them
+    names: list[str] = list(tag_rules.tags)
+
+    tag_rules.alias_index = {sys.intern(alias): [names[position] for position in positions]
+                             for alias, positions in data['alias_index'].items()}
+    tag_rules.add_tags_closure = {tag_name: tuple(names[position] for position in positions)
+                                  for tag_name, positions in zip(names, data['add_tags_closure'])}
+    tag_rules.cycles = data['cycles']
+
+    return tag_rules
+
+
+def save(path: str, key: str, tag_rules: tag_util.TagRules):
+    #* The key is stored uncompressed in front, a stale snapshot is rejected without decompressing it
+    content = key.encode('ascii') + b'\n' + zlib.compress(json.dumps(to_data(tag_rules), separators=(',', ':')).encode('utf-8'))
+    helper.write_atomic(path, content, 'wb')
+
+
+def load(path: str, key: str) -> Optional[tag_util.TagRules]:
+    #* Loading creates many objects at once, without pausing the cycle collector
+    #* it would walk the whole heap several times, which takes longer than the load itself
+    gc_enabled = gc.isenabled()
+    gc.disable()
+
+    try:
+        with open(path, 'rb') as file:
+            if file.readline().rstrip(b'\n') != key.encode('ascii'):
+                return None
+
+            return from_data(json.loads(zlib.decompress(file.read())))
+    except (OSError, ValueError, KeyError, TypeError, IndexError, zlib.error):
+        #* No usable snapshot, the rules get rebuilt
+        return None
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
+def load_or_build(db: DB, library_path: str, stats: instrumentation.SyncStats = instrumentation.DISABLED) -> tag_util.TagRules:
+    '''
+    Load the compiled rules from the snapshot if nothing they depend on changed, else build and save them
+    '''
+    path = os.path.join(library_path, SNAPSHOT_FILE_NAME)
+
+    with stats.phase('snapshot'):
+        key = snapshot_key(db)
+        tag_rules = load(path, key)
+
+    if tag_rules is not None:
+        stats.count('snapshot loaded')
+        return tag_rules
+
+    tag_rules = tag_util.TagRules.build_tag_rules(db, stats)
+
+    with stats.phase('snapshot'):
+        try:
+            save(path, key, tag_rules)
+        except OSError:
+            logger.warning('Saving the rule snapshot failed', exc_info=True)
+
+    return tag_rules
@@ -0,0 +1,141 @@
+from contextlib import contextmanager
+from typing import Optional, Self
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+
+#* One store per library, in the library folder like the prefs
+RULE_STORE_FILE_NAME = 'tag_sync_rules.sqlite'
+RULE_STORE_VERSION = 1
+
+class RuleStore:
+    '''
+    Rule settings of every tag, keyed by tag descriptor.
+    The entries have the shape of the former `prefs['tags']` entries:
+    {'name': ..., 'display_name': ..., 'name_aliases': [...], 'add_tags': [...], 'split_tag_auto': False}
+    '''
+    def __init__(self, path: str):
+        self.path   : str            = path
+        self.lock   : threading.Lock = threading.Lock()
+
+        #* Threads still reading the store, it is only closed after the last one
+        self.users  : int            = 0
+        self.retired: bool           = False
+
+        #* Shared by the GUI, the sync job and the settings loader, every access holds the lock
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+
+        with self.lock, self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS tag_rules (descriptor TEXT PRIMARY KEY, name TEXT NOT NULL, data TEXT NOT NULL)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS tag_rules_name ON tag_rules (name)')
+            self.connection.execute('INSERT OR IGNORE INTO meta (key, value) VALUES (?, ?)', ('version', str(RULE_STORE_VERSION)))
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.connection.execute('SELECT COUNT(*) FROM tag_rules').fetchone()[0]
+
+    def all(self) -> dict[str, dict]:
+        #* In insertion order, like the prefs dict
+        with self.lock:
+            rows = self.connection.execute('SELECT descriptor, data FROM tag_rules ORDER BY rowid').fetchall()
+
+        return {descriptor: json.loads(data) for descriptor, data in rows}
+
+    def get(self, descriptor: str) -> Optional[dict]:
+        with self.lock:
+            row = self.connection.execute('SELECT data FROM tag_rules WHERE descriptor = ?', (descriptor,)).fetchone()
+
+        return json.loads(row[0]) if row else None
+
+    def names(self) -> dict[str, str]:
+        '''
+        Tag name of every entry, without decoding the rules
+        '''
+        with self.lock:
+            return dict(self.connection.execute('SELECT descriptor, name FROM tag_rules ORDER BY rowid'))
+
+    def digest(self) -> str:
+        '''
+        Hash over all entries, changes with every rule change
+        '''
+        hasher = hashlib.blake2b(digest_size=16)
+
+        with self.lock:
+            for descriptor, data in self.connection.execute('SELECT descriptor, data FROM tag_rules ORDER BY rowid'):
+                hasher.update(f'{descriptor}\x1f{data}\x1e'.encode('utf-8'))
+
+        return hasher.hexdigest()
+
+    def update(self, entries: dict[str, Optional[dict]]):
+        '''
+        Write or, for None, delete the given entries in one transaction
+        '''
+        upserts = [(descriptor, entry.get('name', ''), json.dumps(entry, separators=(',', ':')))
+                   for descriptor, entry in entries.items() if entry is not None]
+        deletes = [(descriptor,) for descriptor, entry in entries.items() if entry is None]
+
+        with self.lock, self.connection:
+            #* Updating in place keeps the position of an entry
+            self.connection.executemany('INSERT INTO tag_rules (descriptor, name, data) VALUES (?, ?, ?) '
+                                        'ON CONFLICT (descriptor) DO UPDATE SET name = excluded.name, data = excluded.data', upserts)
+            self.connection.executemany('DELETE FROM tag_rules WHERE descriptor = ?', deletes)
+
+    def migrate(self, prefs):
+        '''
+        Move the rules of the old `prefs['tags']` entry into the store
+        '''
+        if 'tags' not in prefs:
+            return
+
+        self.update(prefs['tags'])
+
+        #* Only removed once the store has them
+        del prefs['tags']
+
+    def export_json(self, path: str):
+        #* Same layout as the old prefs, so the rules stay readable without the store
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump({'tags': self.all()}, file, indent=2, ensure_ascii=False)
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    @contextmanager
+    def use(self):
+        '''
+        Keep the store open while a job or loader thread may read it
+        '''
+        with self.lock:
+            self.users += 1
+
+        try:
+            yield self
+        finally:
+            with self.lock:
+                self.users -= 1
+                unused = self.retired and self.users == 0
+
+            if unused:
+                self.close()
+
+    def retire(self):
+        '''
+        Close the store now or, if a thread still uses it, when that thread is done
+        '''
+        with self.lock:
+            self.retired = True
+            unused = self.users == 0
+
+        if unused:
+            self.close()
+
+    @classmethod
+    def open(cls, library_path: str, prefs) -> Self:
+        store = RuleStore(os.path.join(library_path, RULE_STORE_FILE_NAME))
+        store.migrate(prefs)
+
+        return store
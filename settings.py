@@ -0,0 +1,27 @@
+from . import rule_store
+from calibre.utils.config import JSONConfig
+
+#* This is where all preferences for this plugin will be stored
+#* prefs for this addon are library dependent and get reloaded if the library is switched
+#* The File gets stored alongside your main DB file at your library path
+#* This module doesn't load any GUI libraries, so the sync can run headless
+prefs: JSONConfig = None
+
+#* The per tag rules are kept in their own store, the prefs only hold the general settings
+rules: rule_store.RuleStore = None
+
+def set_prefs(library_path):
+    global prefs, rules
+    prefs = JSONConfig('tag_sync', library_path)
+    prefs.defaults['columns'] = {'tags': {'include': True, 'prio': 0, 'split_tag_auto': True}}
+    prefs.defaults['collect_stats'] = True
+    prefs.defaults['merge_aliases'] = False
+    prefs.defaults['last_search'] = ''
+    prefs.defaults['chunk_size'] = 1000
+
+    #* The store of the previous library is closed once no running sync job or tag loader reads it anymore
+    if rules is not None:
+        rules.retire()
+
+    #* Older versions kept the rules in prefs['tags'], they get moved to the store on first use
+    rules = rule_store.RuleStore.open(library_path, prefs)
@@ -0,0 +1,324 @@
+from . import instrumentation, ledger, rule_snapshot, settings, tag_util
+from calibre.db.cache import Cache as DB
+from dataclasses import dataclass
+from typing import Collection, Iterable, Iterator, Optional
+from queue import Queue
+from threading import Event
+import itertools
+
+#* Default number of books that are read, processed and written together, see the `chunk_size` option
+CHUNK_SIZE = 1000
+
+@dataclass
+class TagChange:
+    book_id   : int
+    column    : str
+    old_values: tuple[str, ...]
+    new_values: tuple[str, ...]
+
+
+@dataclass
+class ChangeSet:
+    '''
+    The changes of one chunk until they are written.
+    A whole sync only keeps the summary of its written chunks, its memory doesn't grow with the changes.
+    '''
+    changes         : list[TagChange]
+    book_count      : int
+    cancelled       : bool
+    fingerprints    : dict[int, str]
+    written_book_ids: set[int]
+    written_columns : set[str]
+    written_changes : int
+
+    def __init__(self):
+        self.changes         : list[TagChange] = list()
+        self.book_count      : int             = 0
+        self.cancelled       : bool            = False
+        self.fingerprints    : dict[int, str]  = dict()
+        self.written_book_ids: set[int]        = set()
+        self.written_columns : set[str]        = set()
+        self.written_changes : int             = 0
+
+    def extend(self, other: 'ChangeSet'):
+        #* Only called with written change sets, their changes and fingerprints are dropped
+        self.book_count += other.book_count
+        self.written_book_ids.update(other.changed_book_ids())
+        self.written_columns.update(other.changed_columns())
+        self.written_changes += other.column_change_count()
+
+    def changed_book_ids(self) -> set[int]:
+        #* Books changed by a table level merge have no per book change
+        return {change.book_id for change in self.changes} | self.written_book_ids
+
+    def changed_columns(self) -> set[str]:
+        return {change.column for change in self.changes} | self.written_columns
+
+    def column_change_count(self) -> int:
+        return len(self.changes) + self.written_changes
+
+    def untouched_count(self) -> int:
+        return self.book_count - len(self.changed_book_ids())
+
+    def by_column(self) -> dict[str, dict[int, tuple[str, ...]]]:
+        #* Group the new values per column, ready for `set_field`
+        result: dict[str, dict[int, tuple[str, ...]]] = dict()
+        for change in self.changes:
+            result.setdefault(change.column, dict())[change.book_id] = change.new_values
+
+        return result
+
+
+def get_synced_columns(db: DB) -> list[str]:
+    #* Only the columns from the settings that still exist in the library
+    return [column_name for column_name in settings.prefs['columns'] if column_name in db.fields]
+
+
+def get_chunk_size() -> int:
+    return settings.prefs.get('chunk_size', CHUNK_SIZE) or CHUNK_SIZE
+
+
+def iter_chunks(book_ids: Iterable[int], chunk_size: int) -> Iterator[list[int]]:
+    #* Slices any iterable, the book ids don't need to be copied into a list first
+    book_id_iter = iter(book_ids)
+    while chunk := list(itertools.islice(book_id_iter, chunk_size)):
+        yield chunk
+
+
+def read_columns(db: DB, columns: list[str], book_ids: list[int],
+                 stats: instrumentation.SyncStats = instrumentation.DISABLED) -> dict[str, dict[int, tuple[str, ...]]]:
+    #* Every column is read with one call for all given books
+    with stats.phase('read'):
+        return {column_name: db.all_field_for(column_name, book_ids, default_value=()) for column_name in columns}
+
+
+def read_chunks(db: DB, columns: list[str], book_ids: Iterable[int], chunk_size: int,
+                stats: instrumentation.SyncStats = instrumentation.DISABLED) -> Iterator[tuple[list[int], dict[str, dict[int, tuple[str, ...]]]]]:
+    '''
+    Yield the values of the given columns chunk by chunk, only one chunk is held in memory at a time
+    '''
+    for chunk in iter_chunks(book_ids, chunk_size):
+        yield chunk, read_columns(db, columns, chunk, stats)
+
+
+def apply_to_chunk(tag_rules: tag_util.TagRules, columns: list[str], book_ids: list[int],
+                   column_values: dict[str, dict[int, tuple[str, ...]]],
+                   stats: instrumentation.SyncStats = instrumentation.DISABLED) -> ChangeSet:
+    '''
+    Apply the tag rules to already read column values and collect the columns whose values change
+    '''
+    change_set = ChangeSet()
+
+    with stats.phase('apply'):
+        #* Group the books by their tags, the result of the rules only depends on the set of lowercase names
+        groups: dict[frozenset[str], list[int]] = dict()
+        for book_id in book_ids:
+            tag_set = frozenset(value.lower() for column_name in columns for value in column_values[column_name][book_id] or ())
+            groups.setdefault(tag_set, list()).append(book_id)
+
+        for tag_set, group_book_ids in groups.items():
+            ordered_tags = tag_rules.apply_to_tag_set(columns, tag_set, stats, len(group_book_ids))
+            new_value_sets = {column_name: set(display_names) for column_name, display_names in ordered_tags.items()}
+
+            #* Fingerprint of the columns as they are after the sync
+            book_fingerprint = ledger.fingerprint(list(ordered_tags.values()))
+
+            for book_id in group_book_ids:
+                #* Compare order-insensitive, only real differences are changes
+                for column_name, display_names in ordered_tags.items():
+                    old_values = tuple(column_values[column_name][book_id] or ())
+                    if set(old_values) != new_value_sets[column_name]:
+                        change_set.changes.append(TagChange(book_id, column_name, old_values, display_names))
+
+                change_set.fingerprints[book_id] = book_fingerprint
+                change_set.book_count += 1
+
+    stats.count('books processed', change_set.book_count)
+    stats.count('books changed', len(change_set.changed_book_ids()))
+
+    return change_set
+
+
+def write_change_set(db: DB, change_set: ChangeSet, stats: instrumentation.SyncStats = instrumentation.DISABLED):
+    #* Write every changed column with a single call
+    with stats.phase('write'):
+        for column_name, book_id_to_values in change_set.by_column().items():
+            db.set_field(column_name, book_id_to_values)
+
+
+def merge_aliased_items(db: DB, tag_rules: tag_util.TagRules, book_ids: Collection[int],
+                        stats: instrumentation.SyncStats = instrumentation.DISABLED) -> ChangeSet:
+    '''
+    Rename every item that is the alias of a single tag in the same column to that tag,
+    calibre merges it into the item of the tag for all its books at once.
+    The books then only need per book writes for moves to other columns and add tags.
+    '''
+    change_set = ChangeSet()
+
+    #* A merge for a part of the library only moves the given books to the tag
+    restrict_to_book_ids = None if len(book_ids) >= len(db.all_book_ids()) else set(book_ids)
+
+    with stats.phase('merge'):
+        for column_name in get_synced_columns(db):
+            item_renames: dict[int, str] = dict()
+
+            #* A locked copy, the GUI can change the items while the job runs
+            for item_id, item_name in db.get_id_map(column_name).items():
+                tag_names = tag_rules.alias_index.get(item_name.lower(), ())
+
+                #* An alias of several tags adds all of them, that can't be a merge
+                if len(tag_names) != 1:
+                    continue
+
+                tag = tag_rules.tags[tag_names[0]]
+                if tag.collection_name == column_name and tag.id is not None and tag.id != item_id:
+                    item_renames[item_id] = tag.display_name
+
+            if item_renames:
+                merged_book_ids, _id_map = db.rename_items(column_name, item_renames, restrict_to_book_ids=restrict_to_book_ids)
+
+                change_set.written_book_ids.update(merged_book_ids)
+                change_set.written_columns.add(column_name)
+                stats.count('items merged', len(item_renames))
+
+    return change_set
+
+
+def sync_books(db: DB, tag_rules: tag_util.TagRules, book_ids: Collection[int], chunk_size: Optional[int] = None,
+               abort: Optional[Event] = None, notifications: Optional[Queue] = None,
+               stats: instrumentation.SyncStats = instrumentation.DISABLED,
+               book_ledger: Optional[ledger.Ledger] = None) -> ChangeSet:
+    '''
+    Apply the tag rules to the books chunk by chunk, reading and writing only the synced columns.
+    Each chunk is written before the next one is read, so cancelling keeps the written chunks intact
+    and the memory for the book data doesn't grow with the library.
+    With the `merge_aliases` option, aliases in the same column are merged at table level first.
+    The fingerprints of the synced books go into `book_ledger` chunk by chunk, it isn't saved here.
+    '''
+    change_set = ChangeSet()
+    columns = get_synced_columns(db)
+
+    if book_ids and settings.prefs.get('merge_aliases', False):
+        change_set.extend(merge_aliased_items(db, tag_rules, book_ids, stats))
+
+    for chunk, column_values in read_chunks(db, columns, book_ids, chunk_size or get_chunk_size(), stats):
+        #* Only stop between chunks
+        if abort is not None and abort.is_set():
+            change_set.cancelled = True
+            break
+
+        chunk_change_set = apply_to_chunk(tag_rules, columns, chunk, column_values, stats)
+        write_change_set(db, chunk_change_set, stats)
+
+        if book_ledger is not None:
+            book_ledger.fingerprints.update(chunk_change_set.fingerprints)
+        change_set.extend(chunk_change_set)
+
+        if notifications is not None:
+            notifications.put((change_set.book_count / len(book_ids), f'Synced {change_set.book_count} of {len(book_ids)} books'))
+
+    return change_set
+
+
+def select_incremental_books(db: DB, book_ledger: ledger.Ledger, changed_keys: set[str],
+                             chunk_size: Optional[int] = None) -> list[int]:
+    '''
+    Find the books whose synced columns changed since they were recorded in the ledger,
+    or that carry a tag or alias whose rules changed
+    '''
+    columns = get_synced_columns(db)
+    result: list[int] = list()
+
+    for chunk, column_values in read_chunks(db, columns, db.all_book_ids(), chunk_size or get_chunk_size()):
+        for book_id in chunk:
+            values = [tuple(column_values[column_name][book_id] or ()) for column_name in columns]
+
+            if book_ledger.fingerprints.get(book_id) != ledger.fingerprint(values):
+                result.append(book_id)
+            elif changed_keys and any(value.lower() in changed_keys for column_value in values for value in column_value):
+                result.append(book_id)
+
+    return result
+
+
+def sync_incremental(db: DB, tag_rules: tag_util.TagRules, book_ledger: ledger.Ledger,
+                     abort: Optional[Event] = None, notifications: Optional[Queue] = None,
+                     stats: instrumentation.SyncStats = instrumentation.DISABLED, chunk_size: Optional[int] = None) -> ChangeSet:
+    '''
+    Only sync the books the ledger reports as changed or affected by changed rules, then update the ledger
+    '''
+    with stats.phase('ledger'):
+        signatures = ledger.rule_signatures(tag_rules, get_synced_columns(db))
+        changed_keys = book_ledger.changed_keys(signatures)
+
+        book_ids = select_incremental_books(db, book_ledger, changed_keys, chunk_size)
+
+    change_set = sync_books(db, tag_rules, book_ids, chunk_size, abort=abort, notifications=notifications, stats=stats,
+                            book_ledger=book_ledger)
+
+    with stats.phase('ledger'):
+        #* Forget deleted books
+        all_book_ids = db.all_book_ids()
+        book_ledger.fingerprints = {book_id: value for book_id, value in book_ledger.fingerprints.items() if book_id in all_book_ids}
+
+        #* A cancelled run keeps the old rules, the skipped books are found again next run
+        if not change_set.cancelled:
+            book_ledger.rule_signatures = signatures
+            book_ledger.rules_version = ledger.rules_version(signatures)
+
+        book_ledger.save()
+
+    return change_set
+
+
+def record_full_sync(db: DB, tag_rules: tag_util.TagRules, book_ledger: ledger.Ledger, book_ids: Collection[int], change_set: ChangeSet):
+    '''
+    Replace the ledger after all books of the library were synced,
+    `sync_books` already put the fingerprints of the synced books into it
+    '''
+    if change_set.cancelled:
+        return
+
+    signatures = ledger.rule_signatures(tag_rules, get_synced_columns(db))
+
+    book_ledger.rule_signatures = signatures
+    book_ledger.rules_version = ledger.rules_version(signatures)
+
+    #* Only the synced books, entries of deleted books go away
+    book_ids = set(book_ids)
+    book_ledger.fingerprints = {book_id: value for book_id, value in book_ledger.fingerprints.items() if book_id in book_ids}
+    book_ledger.save()
+
+
+def run_sync(db: DB, library_path: str, book_ids: Optional[Collection[int]], all_books: bool,
+             abort: Optional[Event] = None, notifications: Optional[Queue] = None,
+             stats: instrumentation.SyncStats = instrumentation.DISABLED,
+             rule_cache: Optional[tag_util.RuleCache] = None, chunk_size: Optional[int] = None) -> tuple[tag_util.TagRules, ChangeSet]:
+    '''
+    Build the tag rules and sync the books, used by the background job and the command line.
+    Without book ids only the books the ledger reports as changed are synced.
+    With a `rule_cache` the rules of the previous sync are reused if they are still valid,
+    else they come from the snapshot in the library folder or get rebuilt.
+    Without a `chunk_size` the one from the settings is used.
+    '''
+    if notifications is not None:
+        notifications.put((0.0, 'Building tag rules'))
+
+    build = lambda: rule_snapshot.load_or_build(db, library_path, stats)
+    tag_rules = rule_cache.get(db, stats, build) if rule_cache is not None else build()
+
+    if book_ids is None:
+        change_set = sync_incremental(db, tag_rules, ledger.Ledger.load(library_path), abort=abort, notifications=notifications, stats=stats,
+                                      chunk_size=chunk_size)
+    else:
+        #* Only a sync of the whole library can replace the ledger
+        book_ledger = ledger.Ledger.load(library_path) if all_books else None
+
+        change_set = sync_books(db, tag_rules, book_ids, chunk_size, abort=abort, notifications=notifications, stats=stats,
+                                book_ledger=book_ledger)
+
+        if book_ledger is not None:
+            with stats.phase('ledger'):
+                record_full_sync(db, tag_rules, book_ledger, book_ids, change_set)
+
+    return tag_rules, change_set
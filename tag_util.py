@@ -1,29 +1,45 @@
-from . import config, helper
+from . import helper, instrumentation, settings
 from calibre.db.cache import Cache as DB
 from calibre.ebooks.metadata.book.base import Metadata
-from calibre.gui2.ui import Main as GUI
+from collections import OrderedDict
 from dataclasses import dataclass
-from typing import Self, Optional
+from typing import Callable, Iterator, Self, Optional
+import logging
 import re
+import sys
+import threading
 
-@dataclass
+logger = logging.getLogger(__name__)
+
+#* Number of distinct tag combinations whose result is kept by `TagRules.apply_to_tag_set`
+RESULT_CACHE_SIZE = 10000
+
+@dataclass(slots=True)
 class Tag:
+    '''
+    Tens of thousands of tags get built for every sync, so they are slotted,
+    their lowercase names are interned and the rule lists are tuples
+    '''
     id             : Optional[int]
     collection_name: str
     display_name   : str
     name           : str
-    name_aliases   : list[str]
-    add_tags       : list[str]
+    name_aliases   : tuple[str, ...]
+    add_tags       : tuple[str, ...]
+    split_tag      : bool
+    in_book_count  : int
+    prio           : int
 
     def __init__(self, display_name: str, collection: str, id: Optional[int]):
-        self.id             : Optional[int] = id
-        self.collection_name: str           = collection
-        self.display_name   : str           = display_name
-        self.name           : str           = display_name.lower()
-        self.name_aliases   : list[str]     = list()
-        self.add_tags       : list[str]     = list()
-        self.split_tag      : bool          = True
-        self.in_book_count  : int           = 0
+        self.id             : Optional[int]   = id
+        self.collection_name: str             = sys.intern(collection)
+        self.display_name   : str             = display_name
+        self.name           : str             = sys.intern(display_name.lower())
+        self.name_aliases   : tuple[str, ...] = ()
+        self.add_tags       : tuple[str, ...] = ()
+        self.split_tag      : bool            = True
+        self.in_book_count  : int             = 0
+        self.prio           : int             = 1
 
     def is_part_of_sub_collection(self) -> bool:
         return self.collection_name != 'tags'
@@ -32,112 +48,244 @@ class Tag:
         return f'{self.collection_name}:{self.id}'
 
     @classmethod
-    def build_tags(cls, gui: GUI) -> list[Self]:
-        db = helper.get_db(gui)
+    def build_tags(cls, db: DB, with_counts: bool = True) -> list[Self]:
+        '''
+        Build the tags of all synced columns, `in_book_count` is only filled with `with_counts`
+        '''
+        #* Keyed by name to find duplicates
+        results: dict[str, Self] = dict()
 
-        results: list[Self] = list()
+        for _column, _column_tags in cls.build_tags_by_column(db, results, with_counts):
+            pass
 
-        column_settings = config.prefs.get('columns', dict())
-        tag_settigns = config.prefs.get('tags', dict())
+        return list(results.values())
+
+    @classmethod
+    def build_tags_by_column(cls, db: DB, results: dict[str, Self], with_counts: bool = True) -> Iterator[tuple[str, list[Self]]]:
+        '''
+        Build the tags into `results`, keyed by name, one column at a time.
+        Yields each column with the tags it added or that replaced a duplicate.
+        '''
+        column_settings = settings.prefs.get('columns', dict())
+        tag_settigns = settings.rules.all()
+
+        #* Index the settings by descriptor and by name, positions keep the order of the settings
+        tag_settings_list: list[dict] = list(tag_settigns.values())
+        settings_by_descriptor: dict[str, int] = dict()
+        settings_by_name: dict[str, list[int]] = dict()
+        for position, (tag_setting_descriptor, tag_settings_data) in enumerate(tag_settigns.items()):
+            settings_by_descriptor[tag_setting_descriptor] = position
+            settings_by_name.setdefault(tag_settings_data.get('name', ''), list()).append(position)
 
         #* Get the list of custom columns
-        columns = helper.get_selected_columns(gui)
+        columns = helper.get_selected_columns(db)
         for column in columns:
             column_values = helper.get_all_field_values(db, column)
+
+            #* Count the usage of all values of the column at once
+            usage_counts: dict[int, int] = db.get_usage_count_by_id(column) if with_counts else dict()
+            column_tags: list[Self] = list()
+
             for value_id, value_name in column_values:
                 tag = Tag(value_name, column, value_id)
 
                 tag.prio = column_settings.get(column, dict()).get('prio', 1)
-                tag.in_book_count = len(db.books_for_field(column, value_id))
+                tag.in_book_count = usage_counts.get(value_id, 0)
 
-                #* Load data from Settings
-                for tag_setting_descriptor, tag_settings_data in tag_settigns.items():
-                    if tag.get_descriptor == tag_setting_descriptor or tag.name == tag_settings_data.get('name', ''):
-                        for name_alias in tag_settings_data.get('name_aliases', list()):
-                            if not name_alias in tag.name_aliases:
-                                tag.name_aliases.append(name_alias)
+                #* Collect the lists in dicts, they keep the first position of every entry
+                name_aliases: dict[str, None] = dict()
+                add_tags: dict[str, None] = dict()
 
-                        for add_tag in tag_settings_data.get('add_tags', list()):
-                            if not add_tag in tag.add_tags:
-                                tag.add_tags.append(add_tag)
+                #* Load data from Settings, matching by descriptor or by name
+                positions = set(settings_by_name.get(tag.name, ()))
+                if tag.get_descriptor() in settings_by_descriptor:
+                    positions.add(settings_by_descriptor[tag.get_descriptor()])
 
-                        if not tag_settings_data.get('split_tag_auto', True):
-                            tag.split_tag = False
+                for position in sorted(positions):
+                    tag_settings_data = tag_settings_list[position]
+
+                    name_aliases.update(dict.fromkeys(tag_settings_data.get('name_aliases', list())))
+                    add_tags.update(dict.fromkeys(tag_settings_data.get('add_tags', list())))
+
+                    if not tag_settings_data.get('split_tag_auto', True):
+                        tag.split_tag = False
 
                 #* Try spliting the display name into alias and add_part 'alias (add_part)'
                 #* and adding the parts to the lists
                 if tag.split_tag:
-                    match = re.match(r"^([^\(]*?)\(([^\)]*?)\)\s*$", tag.display_name)
-                    if match:
-                        match1_alias = match.group(1).strip().lower()
-                        match2_add = match.group(2).strip()
+                    split_parts = split_display_name(tag.display_name)
+                    if split_parts:
+                        name_aliases.setdefault(split_parts[0].lower())
+                        add_tags.setdefault(split_parts[1])
 
-                        if not match1_alias in tag.name_aliases:
-                            tag.name_aliases.append(match1_alias)
-                        if not match2_add in tag.add_tags:
-                            tag.add_tags.append(match2_add)
+                tag.name_aliases = tuple(sys.intern(name_alias) for name_alias in name_aliases)
+                tag.add_tags = tuple(add_tags)
 
                 #* Find duplicates
-                duplicate_found = False
-                for result in results:
-                    if tag.name == result.name:
-                        #* Duplicate found
-                        if tag.prio > result.prio:
-                            tag.in_book_count += result.in_book_count
-
-                            results.remove(result)
-                            results.append(tag)
-                        else:
-                            result.in_book_count += tag.in_book_count
-
-                        duplicate_found = True
-                        break
-
-                if not duplicate_found:
-                    results.append(tag)
-
-        return results
+                result = results.get(tag.name)
+                if result is None:
+                    results[tag.name] = tag
+                    column_tags.append(tag)
+                elif tag.prio > result.prio:
+                    #* Duplicate found, the tag with the higher priority moves to the end
+                    tag.in_book_count += result.in_book_count
+
+                    del results[tag.name]
+                    results[tag.name] = tag
+                    column_tags.append(tag)
+                else:
+                    result.in_book_count += tag.in_book_count
+
+            yield column, column_tags
+
+    @staticmethod
+    def usage_counts_by_name(db: DB) -> dict[str, int]:
+        '''
+        `in_book_count` of every tag name, duplicates in several columns are summed up like in `build_tags`
+        '''
+        counts: dict[str, int] = dict()
+
+        for column in helper.get_selected_columns(db):
+            id_map = db.get_id_map(column)
+
+            for value_id, usage_count in db.get_usage_count_by_id(column).items():
+                #* Items added between the two reads are skipped
+                value_name = id_map.get(value_id)
+                if value_name is not None:
+                    name = value_name.lower()
+                    counts[name] = counts.get(name, 0) + usage_count
+
+        return counts
+
+    @staticmethod
+    def books_by_name(db: DB) -> dict[str, set[int]]:
+        '''
+        Inverted index from every lowercase item name of the synced columns to the books using it
+        '''
+        index: dict[str, set[int]] = dict()
+
+        for column in helper.get_selected_columns(db):
+            id_map = db.get_id_map(column)
+
+            #* Runs in the tag loader thread, the table must not change during the walk
+            with db.safe_read_lock:
+                col_book_map = db.fields[column].table.col_book_map
+
+                for value_id, book_ids in col_book_map.items():
+                    value_name = id_map.get(value_id)
+                    if book_ids and value_name is not None:
+                        index.setdefault(value_name.lower(), set()).update(book_ids)
+
+        return index
+
+def split_display_name(display_name: str) -> Optional[tuple[str, str]]:
+    #* 'alias (add_part)' is split into its stripped parts
+    match = re.match(r"^([^\(]*?)\(([^\)]*?)\)\s*$", display_name)
+    return (match.group(1).strip(), match.group(2).strip()) if match else None
+
+def rule_impact(book_index: dict[str, set[int]], tag_name: str,
+                old_aliases: tuple[str, ...], old_add_tags: tuple[str, ...],
+                new_aliases: tuple[str, ...], new_add_tags: tuple[str, ...]) -> set[int]:
+    '''
+    Books whose tags change when the rules of one tag change, without applying the rules.
+    The sync only adds tags, so removed aliases and add tags change no book.
+    Only the direct effect is counted, not chains through other tags.
+    '''
+    affected: set[int] = set()
+
+    #* Books with a new alias get converted to the tag
+    for name_alias in set(new_aliases) - set(old_aliases):
+        affected.update(book_index.get(name_alias, ()))
+
+    #* New add tags only change the books of the tag that don't have them yet
+    added_tags = {add_tag.lower() for add_tag in new_add_tags} - {add_tag.lower() for add_tag in old_add_tags}
+    if added_tags:
+        tag_book_ids: set[int] = set()
+        for name in {tag_name, *new_aliases}:
+            tag_book_ids.update(book_index.get(name, ()))
+
+        for added_tag in added_tags:
+            affected.update(tag_book_ids - book_index.get(added_tag, set()))
+
+    return affected
 
 @dataclass
 class TagRules:
-    tags: dict[str, Tag]
+    tags            : dict[str, Tag]
+    alias_index     : dict[str, list[str]]
+    add_tags_closure: dict[str, tuple[str, ...]]
+    cycles          : list[list[str]]
+    result_cache    : OrderedDict
 
     def __init__(self):
-        self.tags: dict[str, Tag] = dict()
+        self.tags            : dict[str, Tag]             = dict()
+        self.alias_index     : dict[str, list[str]]       = dict()
+        self.add_tags_closure: dict[str, tuple[str, ...]] = dict()
+        self.cycles          : list[list[str]]            = list()
+        self.result_cache    : OrderedDict                = OrderedDict()
 
     def apply_to_book(self, book: Metadata) -> Metadata:
-        columns = config.prefs['columns']
+        columns = settings.prefs['columns']
 
         #* Get the list of all tags on the book
         current_display_tags: list[str] = list()
         for column_name in columns:
             current_display_tags.extend(book.get(column_name, []))
 
+        ordered_tags = self.apply_to_tags(columns, current_display_tags)
+
+        #* Apply the orderd tags to the book, skip columns that don't change
+        for key, value in ordered_tags.items():
+            if set(value) == set(book.get(key) or ()):
+                continue
+
+            if len(value) <= 0:
+                value.append('') #* An empty array dosent overwrite for some rason
+                book.set(key, value)
+            else:
+                book.set(key, value)
+
+        #* Return the book
+        return book
+
+    def apply_to_tags(self, columns: list[str], current_display_tags: list[str], counters: Optional[dict[str, int]] = None) -> dict[str, list[str]]:
+        '''
+        Apply the rules to the tags of one book and return the resulting display names per column.
+        `counters` receives the number of alias hits and added tags.
+        '''
         #* Convert the current display tags to the compareable format
         current_tags: list = [current_display_tag.lower() for current_display_tag in current_display_tags]
 
         #* Apply the alias restriction
-        tags_to_remove = list()
+        #* Names appended here are visited by the same loop, so alias chains resolve fully
+        current_tags_set: set[str] = set(current_tags)
+        tags_to_remove: set[str] = set()
         for current_tag in current_tags:
-            for tag in self.tags.values():
-                if current_tag in tag.name_aliases:
-                    tags_to_remove.append(current_tag)
+            #* All tags using this alias, if multiple with the same alias exist
+            for tag_name in self.alias_index.get(current_tag, ()):
+                tags_to_remove.add(current_tag)
 
-                    if tag.name not in current_tags:
-                        current_tags.append(tag.name)
-                    #* Don't break' to include all aliases if multiple with the same name exist
+                if tag_name not in current_tags_set:
+                    current_tags.append(tag_name)
+                    current_tags_set.add(tag_name)
 
         current_tags = [current_tag for current_tag in current_tags if current_tag not in tags_to_remove]
 
-        #* Apply the add tags rule
-        tags_to_add = list()
+        #* Apply the add tags rule, the dict keeps the order of the closures
+        tags_to_add: dict[str, None] = dict()
         for current_tag in current_tags:
-            current_tags_obj = self.tags[current_tag]
-            add_add_tags_recursive(self, current_tags_obj, tags_to_add)
+            tags_to_add.update(dict.fromkeys(self.add_tags_closure.get(current_tag, ())))
+
+        current_tags_set = set(current_tags)
+        added_count = len(current_tags)
+        for tag_to_add in tags_to_add:
+            if not tag_to_add in current_tags_set:
+                current_tags.append(tag_to_add)
+        added_count = len(current_tags) - added_count
 
-        for tags_to_add in tags_to_add:
-            if not tags_to_add in current_tags:
-                current_tags.append(tags_to_add)
+        if counters is not None:
+            counters['alias hits'] = len(tags_to_remove)
+            counters['add tags expansions'] = added_count
 
         #* Build the tag dict ordered by collection
         ordered_tags = dict()
@@ -154,57 +302,262 @@ class TagRules:
             else:
                 raise RuntimeError(f'Tag object with name \'{current_tag}\' not found')
 
-        #* Apply the orderd tags to the book
-        for key, value in ordered_tags.items():
-            if len(value) <= 0:
-                value.append('') #* An empty array dosent overwrite for some rason
-                book.set(key, value)
-            else:
-                book.set(key, value)
+        return ordered_tags
 
-        #* Return the book
-        return book
+    def apply_to_tag_set(self, columns: list[str], tag_set: frozenset[str],
+                         stats: instrumentation.SyncStats = instrumentation.DISABLED, book_count: int = 1) -> dict[str, tuple[str, ...]]:
+        '''
+        Memoized `apply_to_tags` for a set of lowercase tag names, the result must not be modified.
+        The counters of the result are added to `stats` once for each of the `book_count` books.
+        '''
+        key = (tuple(columns), tag_set)
+
+        cached = self.result_cache.get(key)
+        if cached is not None:
+            self.result_cache.move_to_end(key)
+        else:
+            counters: dict[str, int] = dict()
+            ordered_tags = self.apply_to_tags(columns, sorted(tag_set), counters)
+            cached = ({column_name: tuple(display_names) for column_name, display_names in ordered_tags.items()}, counters)
+
+            #* Drop the least recently used result to keep the memory bounded
+            self.result_cache[key] = cached
+            if len(self.result_cache) > RESULT_CACHE_SIZE:
+                self.result_cache.popitem(last=False)
+
+        result, counters = cached
+
+        if stats.enabled:
+            for name, value in counters.items():
+                stats.count(name, value * book_count)
+
+        return result
 
     @classmethod
-    def build_tag_rules(cls, gui: GUI) -> Self:
+    def build_tag_rules(cls, db: DB, stats: instrumentation.SyncStats = instrumentation.DISABLED) -> Self:
         tag_rules = TagRules()
-        tags = Tag.build_tags(gui)
 
-        for tag in tags:
-            tag_rules.tags[tag.name] = tag
+        with stats.phase('build tags'):
+            #* The sync never reads the usage counts
+            tags = Tag.build_tags(db, with_counts=False)
 
-        return tag_rules
+            for tag in tags:
+                tag_rules.tags[tag.name] = tag
 
-def add_add_tags_recursive(tag_rules: TagRules, tag: Tag, add_list: list[str], max_recursion: int = 30):
-    if max_recursion <= 0:
-        raise RecursionError()
+        with stats.phase('compile rules'):
+            tag_rules.build_alias_index()
+            tag_rules.compile_add_tags(stats)
 
-    #* For all add tags
-    for add_tag_display_name in tag.add_tags:
-        add_tag_name = add_tag_display_name.lower()
-        tag_found = False
+        return tag_rules
+
+    def build_alias_index(self):
+        '''
+        Map every alias to the names of the tags using it, in the order of `self.tags`
+        '''
+        self.alias_index = dict()
+        self.result_cache.clear()
+
+        for tag in self.tags.values():
+            for name_alias in tag.name_aliases:
+                tag_names = self.alias_index.setdefault(name_alias, list())
+
+                #* A tag can list the same alias only once
+                if tag.name not in tag_names:
+                    tag_names.append(tag.name)
+
+    def compile_add_tags(self, stats: instrumentation.SyncStats = instrumentation.DISABLED):
+        '''
+        Resolve the add tags of every tag and precompute their transitive closure.
+        Add tags that match no tag are created in the collection of the tag adding them.
+        '''
+        #* Map every name and alias to the tags it resolves to, in the order of `self.tags`
+        name_index: dict[str, list[str]] = dict()
+        for tag in self.tags.values():
+            for key in [tag.name, *tag.name_aliases]:
+                tag_names = name_index.setdefault(key, list())
+                if tag.name not in tag_names:
+                    tag_names.append(tag.name)
+
+        #* Build the add tags graph
+        add_tags_graph: dict[str, list[str]] = dict()
+        for tag in list(self.tags.values()):
+            add_tag_names = add_tags_graph.setdefault(tag.name, list())
+
+            for add_tag_display_name in tag.add_tags:
+                tag_names = name_index.get(add_tag_display_name.lower(), list())
 
-        #* For all tag object of the tag_rules
-        for find_tag in tag_rules.tags.values():
-            if find_tag == tag:
                 #* Skip the same tag
+                add_tag_name = next((tag_name for tag_name in tag_names if tag_name != tag.name), None)
+
+                if add_tag_name is None:
+                    if add_tag_display_name.lower() == tag.name:
+                        #* The tag adds itself by name
+                        continue
+
+                    #* Create new tag in the collection of the parent tag, also if only an alias of the tag itself matches
+                    new_tag = Tag(add_tag_display_name, tag.collection_name, None)
+                    self.tags[new_tag.name] = new_tag
+                    add_tags_graph[new_tag.name] = list()
+                    stats.count('tags auto-created')
+
+                    #* An existing match stays first for the other tags
+                    if new_tag.name not in tag_names:
+                        name_index.setdefault(new_tag.name, list()).append(new_tag.name)
+
+                    add_tag_name = new_tag.name
+
+                if add_tag_name not in add_tag_names:
+                    add_tag_names.append(add_tag_name)
+
+        #* Compute the closures per strongly connected component, the components
+        #* are found in reverse topological order so all successors are already done
+        self.add_tags_closure = dict()
+        self.cycles = list()
+        self.result_cache.clear()
+        for component in strongly_connected_components(add_tags_graph):
+            if len(component) > 1:
+                self.cycles.append([self.tags[tag_name].display_name for tag_name in component])
+                logger.warning(f'Add tags rules form a cycle: {", ".join(self.cycles[-1])}')
+
+            component_set = set(component)
+            for tag_name in component:
+                self.add_tags_closure[tag_name] = build_closure(add_tags_graph, self.add_tags_closure, component_set, tag_name)
+
+class RuleCache:
+    '''
+    Keeps the compiled tag rules between syncs.
+    Saved settings and library switches drop them, changes to the synced columns
+    only lead to a comparison of the column items before the next sync.
+    '''
+    def __init__(self):
+        self.lock       : threading.Lock            = threading.Lock()
+        self.tag_rules  : Optional[TagRules]        = None
+        self.items      : dict[str, dict[int, str]] = dict()
+        self.check_items: bool                      = False
+        self.generation : int                       = 0
+
+    def invalidate(self):
+        #* Called from the GUI thread, must not wait for a running build
+        self.generation += 1
+        self.tag_rules = None
+
+    def mark_changed(self):
+        #* Can be called from any thread, the check happens when the rules are needed
+        self.check_items = True
+
+    def get(self, db: DB, stats: instrumentation.SyncStats = instrumentation.DISABLED,
+            build: Optional[Callable[[], 'TagRules']] = None) -> 'TagRules':
+        '''
+        The cached rules if they are still valid, else the rules from `build`, by default `TagRules.build_tag_rules`.
+        The lock is only held to read and store the cache, never during a build.
+        '''
+        with self.lock:
+            generation = self.generation
+            tag_rules = self.tag_rules
+            cached_items = self.items
+            check_items = self.check_items
+            self.check_items = False
+
+        #* The rules only depend on the items of the synced columns, not on the books using them
+        items: Optional[dict[str, dict[int, str]]] = None
+        if tag_rules is not None and check_items:
+            items = column_items(db)
+            if items != cached_items:
+                tag_rules = None
+
+        if tag_rules is not None:
+            stats.count('rules reused')
+            return tag_rules
+
+        #* Read the items before the build, a change during the build is found by the next check
+        if items is None:
+            items = column_items(db)
+        tag_rules = build() if build is not None else TagRules.build_tag_rules(db, stats)
+
+        with self.lock:
+            #* Settings saved or library switched during the build, the result may be outdated
+            if generation == self.generation:
+                self.tag_rules = tag_rules
+                self.items = items
+
+        return tag_rules
+
+def column_items(db: DB) -> dict[str, dict[int, str]]:
+    #* Copy of the item names of every synced column, to find out if they changed
+    return {column: db.get_id_map(column) for column in helper.get_selected_columns(db)}
+
+def build_closure(graph: dict[str, list[str]], closures: dict[str, tuple[str, ...]], component: set[str], start: str) -> tuple[str, ...]:
+    '''
+    Depth first walk from `start`, tags outside of the component reuse their finished closure
+    '''
+    closure: dict[str, None] = dict()
+    work = [iter(graph[start])]
+
+    while work:
+        for tag_name in work[-1]:
+            if tag_name in closure:
                 continue
 
-            #* Test if the current tag is the right one
-            if add_tag_name == find_tag.name or add_tag_name in find_tag.name_aliases:
-                #* Add found tag to add_list
-                if find_tag.name not in add_list:
-                    add_list.append(find_tag.name)
-                    add_add_tags_recursive(tag_rules, find_tag, add_list, max_recursion - 1) #* Recursion
+            closure[tag_name] = None
 
-                tag_found = True
+            if tag_name in component:
+                work.append(iter(graph[tag_name]))
                 break
 
-        if not tag_found:
-            #* Create new tag in the collection of the parent tag
-            new_tag = Tag(add_tag_display_name, tag.collection_name, None)
-            tag_rules.tags[new_tag.name] = new_tag
+            closure.update(dict.fromkeys(closures[tag_name]))
+        else:
+            work.pop()
+
+    return tuple(closure)
+
+def strongly_connected_components(graph: dict[str, list[str]]) -> list[list[str]]:
+    '''
+    Iterative Tarjan, components are returned in reverse topological order
+    '''
+    components: list[list[str]] = list()
+    index: dict[str, int] = dict()
+    low_link: dict[str, int] = dict()
+    stack: list[str] = list()
+    on_stack: set[str] = set()
+
+    for root in graph:
+        if root in index:
+            continue
+
+        index[root] = low_link[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        work = [(root, iter(graph[root]))]
+
+        while work:
+            node, successors = work[-1]
+
+            for successor in successors:
+                if successor not in index:
+                    index[successor] = low_link[successor] = len(index)
+                    stack.append(successor)
+                    on_stack.add(successor)
+                    work.append((successor, iter(graph[successor])))
+                    break
+                elif successor in on_stack:
+                    low_link[node] = min(low_link[node], index[successor])
+            else:
+                work.pop()
+
+                if work:
+                    parent = work[-1][0]
+                    low_link[parent] = min(low_link[parent], low_link[node])
+
+                if low_link[node] == index[node]:
+                    component: list[str] = list()
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+
+                        if member == node:
+                            break
+
+                    components.append(component)
 
-            #* Add new tag to add_list
-            if new_tag.name not in add_list:
-                add_list.append(new_tag.name)
+    return components